@@ -3,9 +3,7 @@ import pandas as pd
 import logging
 import traceback
 import uuid
-import io
 import json
-import csv
 from collections import defaultdict
 from utils.preprocess import Preprocessor
 from utils.ddie import DDIE
@@ -13,8 +11,12 @@ from utils.ssg import SSG
 from utils.uaic import UAIC
 from utils.scoring import HybridScorer
 from utils.explain import Explain
-from utils.graph_anomaly import GraphAnomalyDetector
+from utils.graph_anomaly import GraphAnomalyDetector, start_cycle_pool
 from utils.profiling import UserProfiler
+from utils.ingest import StreamingIngestor, UploadStore
+from utils.artifacts import ModelArtifactStore, fit_judge_models
+from utils.judge_state import JudgeState, JudgeSessionStore
+from utils.latency import LatencyBudget, StageCosts
 from utils.report_generator_v2 import ReportGeneratorV2 as ReportGenerator
 import os
 
@@ -24,23 +26,31 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-uploaded_files = {}
-processed_data_cache = {}
+ingestor = StreamingIngestor()
+# file_id -> spooled upload on disk and its cached analysis, bounded by count and idle time
+uploads = UploadStore(ingestor,
+                      max_uploads=int(os.environ.get('VIGILO_MAX_UPLOADS', UploadStore.max_uploads)),
+                      ttl=float(os.environ.get('VIGILO_UPLOAD_TTL', UploadStore.ttl)))
+# 'networkx' (default) or 'sparse' (SciPy CSR, for large transaction networks)
+graph_backend = os.environ.get('VIGILO_GRAPH_BACKEND', 'networkx')
+# Share of the amount a money-loop hop may drop (see GraphAnomalyDetector.loop_amount_tolerance),
+# set on the class so the graphs of Judge Mode states use it too
+if os.environ.get('VIGILO_LOOP_AMOUNT_TOLERANCE'):
+    GraphAnomalyDetector.loop_amount_tolerance = GraphAnomalyDetector(
+        loop_amount_tolerance=float(os.environ['VIGILO_LOOP_AMOUNT_TOLERANCE'])).loop_amount_tolerance
 
 def get_or_process_data(file_id):
     """Helper to get processed dataframe, either from cache or by processing."""
-    if file_id in processed_data_cache:
-        return processed_data_cache[file_id]
+    df = uploads.cached(file_id)
+    if df is not None:
+        return df
 
-    if file_id not in uploaded_files:
+    path = uploads.path(file_id)
+    if path is None:
         raise ValueError("File not found")
 
-    file_content = uploaded_files[file_id]
-    df = pd.read_csv(io.StringIO(file_content))
-    
-    # Preprocess
-    preprocessor = Preprocessor()
-    df = preprocessor.clean_data(df)
+    # Read and preprocess the spooled upload chunk by chunk
+    df = ingestor.load_upload(file_id, path)
     
     # Apply DDIE rules
     ddie = DDIE()
@@ -48,14 +58,15 @@ def get_or_process_data(file_id):
     
     # ML anomaly detection
     uaic = UAIC()
+    features = None
     if len(df) >= 20:
-        uaic.fit(df)
-        ml_scores = [uaic.predict_single(row.to_dict(), df) for _, row in df.iterrows()]
-    else:
-        ml_scores = [0.0] * len(df)
+        # One feature matrix shared by fitting, batch scoring and the explainer
+        features = uaic._create_features(df)
+        uaic.fit(df, features)
+    ml_scores = uaic.predict_batch(df, features)
         
     # Graph-based anomaly detection
-    graph_detector = GraphAnomalyDetector()
+    graph_detector = GraphAnomalyDetector(backend=graph_backend)
     graph_scores, graph_reasons_list, node_paths = graph_detector.detect_anomalies(df)
     
     # Hybrid scoring
@@ -69,9 +80,7 @@ def get_or_process_data(file_id):
     
     explainer = Explain()
     if len(df) >= 20 and uaic.model is not None:
-        features = uaic._create_features(df)
-        feature_names = ['transaction_amount', 'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'user_transaction_frequency']
-        explainer.setup_explainer(uaic.model, features, feature_names)
+        explainer.setup_explainer(uaic.model, features, uaic.feature_names)
 
     for i, row in df.iterrows():
         rule_score = rule_results.iloc[i]['rule_score']
@@ -83,7 +92,7 @@ def get_or_process_data(file_id):
         
         row_features = None
         if len(df) >= 20 and uaic.model is not None:
-            row_features = uaic._create_features_single(row.to_dict(), df)
+            row_features = features[i]
         
         explanation = explainer.generate_explanation(reasons, ml_score, row_features, uaic.model if len(df) >= 20 else None, is_anomalous)
         
@@ -95,12 +104,22 @@ def get_or_process_data(file_id):
     df['is_anomalous'] = is_anomalous_list
     df['explanation'] = explanations
     
-    processed_data_cache[file_id] = df
+    uploads.cache(file_id, df)
     return df
 
+def response_value(value):
+    """Make an uploaded value JSON friendly: blanks as '', timestamps as text."""
+    if pd.isna(value):
+        return ''
+    if isinstance(value, pd.Timestamp):
+        return str(value)
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
 @app.route('/api/upload', methods=['POST'])
 def upload():
-    """Upload CSV file and return file_id for analysis."""
+    """Upload a CSV, Parquet or Arrow file and return file_id for analysis."""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -109,15 +128,14 @@ def upload():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        if not file.filename.endswith('.csv'):
-            return jsonify({'error': 'File must be CSV'}), 400
+        if not ingestor.is_supported(file.filename):
+            return jsonify({'error': 'File must be CSV, Parquet or Arrow'}), 400
 
         # Generate unique file ID
         file_id = str(uuid.uuid4())
 
-        # Read file content and store
-        file_content = file.read().decode('utf-8')
-        uploaded_files[file_id] = file_content
+        # Spool the upload to disk instead of holding its text in memory
+        uploads.add(file_id, ingestor.spool(file, file_id))
 
         logger.info(f"File uploaded with ID: {file_id}")
         return jsonify({'file_id': file_id}), 200
@@ -159,25 +177,25 @@ def view_presentation():
 def analyze(file_id):
     """Analyze uploaded CSV for fake transactions and return all results at once."""
     try:
-        if file_id not in uploaded_files:
+        path = uploads.path(file_id)
+        if path is None:
             return jsonify({'error': 'File not found'}), 404
 
-        file_content = uploaded_files[file_id]
-        csv_reader = csv.DictReader(io.StringIO(file_content))
-        rows = []
-        for row in csv_reader:
-            rows.append(row)
+        # Stream the spooled file through the Preprocessor in bounded chunks, or
+        # reload its typed Parquet spill if it was analyzed before.
+        # raw_df keeps the uploaded values for the response rows.
+        try:
+            raw_df, df = ingestor.load_upload(file_id, path, keep_raw=True)
+        except ValueError as e:
+            # Unreadable file, or required columns missing
+            return jsonify({'error': str(e)}), 400
 
-        if not rows:
+        if df.empty:
             return jsonify({'error': 'Empty CSV file'}), 400
 
-        total_transactions = len(rows)
-        df = pd.DataFrame(rows)
+        total_transactions = len(df)
         
         # Core Engines
-        preprocessor = Preprocessor()
-        df = preprocessor.clean_data(df)
-        
         ddie = DDIE()
         rule_results = ddie.apply_rules(df)
         
@@ -185,28 +203,31 @@ def analyze(file_id):
         stats = ssg.compute_global_stats(df)
         
         uaic = UAIC()
+        features = None
         if total_transactions >= 20: 
-            uaic.fit(df)
+            # One feature matrix shared by fitting, batch scoring and the explainer
+            features = uaic._create_features(df)
+            uaic.fit(df, features)
         
-        graph_detector = GraphAnomalyDetector()
+        graph_detector = GraphAnomalyDetector(backend=graph_backend)
         graph_scores, graph_reasons_list, node_paths = graph_detector.detect_anomalies(df)
         
         # Scoring & Explanation
         scorer = HybridScorer()
-        user_freqs = df['user_id'].value_counts().to_dict() if 'user_id' in df.columns else {}
-        ml_scores = [uaic.predict_single(row, df, precomputed_freqs=user_freqs) if total_transactions >= 20 else 0.0 for row in rows]
+        ml_scores = uaic.predict_batch(df, features)
         scorer.auto_tune_threshold(rule_results['rule_score'].tolist(), ml_scores, graph_scores)
         
         explainer = Explain()
         if total_transactions >= 20 and uaic.model is not None:
-            features = uaic._create_features(df)
-            explainer.setup_explainer(uaic.model, features, ['transaction_amount', 'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'user_transaction_frequency'])
+            explainer.setup_explainer(uaic.model, features, uaic.feature_names)
 
         all_results = []
         anomalous_count = 0
         final_scores, is_anomalous_list, explanations = [], [], []
 
-        for i, row_dict in enumerate(rows):
+        raw_columns = list(raw_df.columns)
+        for i, raw_values in enumerate(raw_df.itertuples(index=False, name=None)):
+            row_dict = {col: response_value(val) for col, val in zip(raw_columns, raw_values)}
             rule_score = rule_results.iloc[i]['rule_score']
             reasons = rule_results.iloc[i]['reasons']
             ml_score = ml_scores[i]
@@ -217,7 +238,7 @@ def analyze(file_id):
             
             row_features = None
             if total_transactions >= 20 and uaic.model is not None:
-                row_features = uaic._create_features_single(row_dict, df, precomputed_freqs=user_freqs)
+                row_features = features[i]
             
             explanation = explainer.generate_explanation(reasons, ml_score, row_features, uaic.model if total_transactions >= 20 else None, is_anomalous, row=row_dict, global_stats=stats, graph_reasons=graph_reasons_list[i] if i < len(graph_reasons_list) else None)
             
@@ -236,7 +257,7 @@ def analyze(file_id):
         
         # Cache for historical retrieval
         df['final_score'], df['is_anomalous'], df['explanation'] = final_scores, is_anomalous_list, explanations
-        processed_data_cache[file_id] = df
+        uploads.cache(file_id, df)
 
         return jsonify({'results': all_results, 'stats': stats})
 
@@ -288,221 +309,358 @@ def generate_report(file_id):
 
 # --- JUDGE MODE IMPLEMENTATION ---
 global_model_context = {}
+# Judge Mode history per analyst session (X-Judge-Session header), bounded by LRU/idle eviction
+judge_sessions = JudgeSessionStore(max_sessions=int(os.environ.get('VIGILO_JUDGE_MAX_SESSIONS', 256)),
+                                   ttl=float(os.environ.get('VIGILO_JUDGE_SESSION_TTL', 1800)))
+
+# Largest micro-batch /api/judge/batch accepts
+JUDGE_MAX_BATCH = int(os.environ.get('VIGILO_JUDGE_MAX_BATCH', 5000))
+# Default Judge Mode latency budget in milliseconds (unset = unbounded)
+JUDGE_LATENCY_BUDGET_MS = os.environ.get('VIGILO_JUDGE_LATENCY_BUDGET_MS')
+# Typical cost of each optional Judge Mode stage, learned across requests
+judge_stage_costs = StageCosts()
+
+def judge_latency_budget():
+    """The request's latency budget in ms (X-Latency-Budget-Ms header, else the default), or None."""
+    value = request.headers.get('X-Latency-Budget-Ms') or JUDGE_LATENCY_BUDGET_MS
+    if not value:
+        return None
+    budget_ms = float(value)
+    if not budget_ms > 0:
+        raise ValueError(f"Latency budget must be a positive number of milliseconds, got {value}")
+    return budget_ms
+
+def judge_graph_edge(state, budget, judged):
+    """
+    Add one cleaned transaction to the session graph and score it, as the
+    budget allows: with the community refresh (when one is due), with the
+    loop search only, or deferred (scored from the communities and loops
+    already known). Once the session's graph holds max_deferred_edges
+    deferred searches, the loop search runs over budget and is reported in
+    over_budget_stages. Returns (graph_score, graph_reasons, node_path).
+    """
+    # Unreadable times leave the loop check untimed
+    timestamp = None if judged.get('timestamp_invalid') else judged['timestamp']
+    edge = (judged['user_id'], judged['recipient_id'], judged['amount'], timestamp)
+    # Every community_refresh_interval() edges the call also reruns
+    # Louvain, so it is budgeted as a stage of its own
+    if state.graph.community_refresh_due() and budget.allows('community_refresh'):
+        with budget.timed('community_refresh'):
+            return state.graph.add_transaction(*edge)
+    if budget.allows('graph', force=not state.graph.can_defer()):
+        with budget.timed('graph'):
+            return state.graph.add_transaction(*edge, refresh=False)
+    return state.graph.add_transaction(*edge, defer=True)
+
+def judge_session_id():
+    """Session (or tenant) a Judge Mode call belongs to; callers without one share 'default'."""
+    return request.headers.get('X-Judge-Session') or 'default'
 
 def init_global_model():
-    """Initialize a global model using sample data for immediate judging."""
+    """
+    Initialize the global Judge Mode model.
+    Fitted models are loaded from the latest saved artifact when there is one
+    (build with `python -m utils.artifacts build <training.csv>`); otherwise
+    they are fitted on the sample data.
+    """
     try:
         sample_path = 'new_sample_transactions.csv'
         if not os.path.exists(sample_path):
             sample_path = os.path.join('sample_data', 'new_sample_transactions.csv')
-            
+
+        df = None
         if os.path.exists(sample_path):
+            df = ingestor.load(sample_path)
+
+        artifact = ModelArtifactStore(os.environ.get('VIGILO_ARTIFACT_DIR', 'artifacts')).load()
+        if artifact is not None:
+            logger.info(f"Loading global model from artifact v{artifact['manifest']['version']}...")
+            uaic = artifact['uaic']
+            scorer = artifact['scorer']
+            features = artifact['features']
+            shap_explainer = artifact['shap_explainer']
+        elif df is not None:
             logger.info("Initializing global model from sample data...")
-            df = pd.read_csv(sample_path)
-            
-            # Preprocess
-            preprocessor = Preprocessor()
-            df = preprocessor.clean_data(df)
-            
-            # Fit UAIC
-            uaic = UAIC()
-            if len(df) >= 20:
-                uaic.fit(df)
-            
-            # Run initial analysis to get score distributions for auto-tuning
-            ddie = DDIE()
-            rule_results = ddie.apply_rules(df)
-            
-            ml_scores = [uaic.predict_single(row.to_dict(), df) for _, row in df.iterrows()] if uaic.model else [0.0]*len(df)
-            
-            graph_detector = GraphAnomalyDetector()
-            graph_scores, _, _ = graph_detector.detect_anomalies(df)
-            
-            scorer = HybridScorer()
-            scorer.auto_tune_threshold(rule_results['rule_score'].tolist(), ml_scores, graph_scores)
-            
-            global_model_context['base_df'] = df.copy()
-            global_model_context['df'] = df
-            global_model_context['uaic'] = uaic
-            global_model_context['scorer'] = scorer
-            global_model_context['explainer'] = Explain()
-            
-            if uaic.model is not None:
-                features = uaic._create_features(df)
-                feature_names = ['transaction_amount', 'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'user_transaction_frequency']
-                global_model_context['explainer'].setup_explainer(uaic.model, features, feature_names)
-                
-            logger.info("Global model initialized successfully.")
+            uaic, scorer, features = fit_judge_models(df, graph_backend)
+            shap_explainer = None
         else:
             logger.warning("Sample data not found. Judge mode might be limited.")
+            return
+
+        # Every session's judged transactions are checked against its own copy
+        # of the sample history; with no sample, sessions start empty
+        judge_sessions.base = JudgeState.from_frame(df) if df is not None else None
+        global_model_context['uaic'] = uaic
+        global_model_context['scorer'] = scorer
+        global_model_context['explainer'] = Explain()
+
+        if uaic.model is not None and features is not None:
+            global_model_context['explainer'].setup_explainer(uaic.model, features, uaic.feature_names, shap_explainer)
+
+        logger.info("Global model initialized successfully.")
     except Exception as e:
         logger.error(f"Failed to initialize global model: {e}")
         logger.error(traceback.format_exc())
 
-# Initialize on startup
-init_global_model()
+# Initialize on startup. Cycle search workers import this module as __mp_main__
+# when the app runs as a script; they need neither the models nor a pool
+if __name__ != '__mp_main__':
+    init_global_model()
+    # Started here, from the main thread, rather than by the first large analysis
+    start_cycle_pool()
 
 @app.route('/api/reset_judge', methods=['POST'])
 def reset_judge():
-    """Reset the Judge Mode context to a truly empty state."""
-    # Ensure we have the standard columns
-    cols = ['transaction_id', 'user_id', 'recipient_id', 'amount', 'timestamp', 'location', 'is_anomalous', 'final_score', 'explanation']
-    
-    if 'base_df' in global_model_context:
-        cols = global_model_context['base_df'].columns
-        
-    global_model_context['df'] = pd.DataFrame(columns=cols)
-    logger.info("Judge Mode context reset to empty state.")
+    """Reset the caller's Judge Mode session to a truly empty state."""
+    session_id = judge_session_id()
+    judge_sessions.reset(session_id)
+    logger.info(f"Judge Mode session {session_id} reset to empty state.")
     return jsonify({'status': 'reset_complete'}), 200
 
+def judge_record(data):
+    """Transaction record for Judge Mode from one request payload, with defaults for missing fields."""
+    from datetime import datetime
+    # Default timestamp if not provided
+    timestamp = data.get('timestamp') or datetime.now().isoformat()
+    return {
+        'transaction_id': data.get('transaction_id') or f"JUDGE-{uuid.uuid4().hex[:8]}",
+        'user_id': data.get('sender_id') or data.get('user_id') or 'JUDGE_USER',
+        'recipient_id': data.get('recipient_id') or data.get('receiver_id') or 'Unknown_Recipient',
+        'amount': float(data.get('amount', 0)),
+        'location': data.get('location', 'Unknown'),
+        'timestamp': timestamp
+    }
+
+def judge_models():
+    """The shared Judge Mode models: (uaic, scorer, explainer), with fallbacks."""
+    uaic = global_model_context.get('uaic')
+    scorer = global_model_context.get('scorer')
+    if not scorer:
+        scorer = HybridScorer() # Fallback
+    explainer = global_model_context.get('explainer')
+    if not explainer:
+        explainer = Explain()
+    return uaic, scorer, explainer
+
+def judge_verdict(scorer, rule_score, reasons, ml_score, graph_score, graph_reasons):
+    """Hybrid score with the Judge Mode override; returns (final_score, is_anomalous, reasons)."""
+    final_score = scorer.compute_hybrid_score(rule_score, ml_score, graph_score)
+
+    # Override for Judge Mode: Make it extremely sensitive to impress judges
+    # If any hard rule triggered OR any Graph Anomaly found, its an Anomaly.
+    any_reasons = (len(reasons) > 0 and rule_score > 0) or (len(graph_reasons) > 0)
+
+    if any_reasons or graph_score > 0.2:
+        final_score = max(final_score, 0.92) # Force very high score for demonstration
+        is_anomalous = True
+        # Merge reasons
+        reasons = list(set(reasons + graph_reasons))
+    else:
+        is_anomalous = bool(scorer.is_anomalous(final_score))
+    return final_score, is_anomalous, reasons
+
+def judge_response(scorer, final_score, is_anomalous, explanation, rule_score, ml_score, graph_score, node_path):
+    """JSON body of one Judge Mode verdict."""
+    return {
+        'is_anomalous': is_anomalous,
+        'final_score': float(final_score),
+        'explanation': explanation,
+        'details': {
+            'rule_score': float(rule_score),
+            'ml_score': float(ml_score),
+            'graph_score': float(graph_score),
+            'weights': {
+                'rule': scorer.rule_weight,
+                'ml': scorer.ml_weight,
+                'graph': scorer.graph_weight
+            },
+            'threshold': scorer.threshold,
+            'node_path': node_path
+        }
+    }
+
 @app.route('/api/judge', methods=['POST'])
 def judge_transaction():
+    """
+    Judge one transaction. Rules and the ML score always run; with a latency
+    budget, the graph community refresh, the graph loop search and the SHAP
+    part of the explanation run only while time is left (in that order) and
+    are otherwise reported in skipped_stages. Stages that had to run although
+    they did not fit are reported in over_budget_stages.
+    """
+    try:
+        budget = LatencyBudget(judge_stage_costs, judge_latency_budget())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
-        data = request.json
-        amount = float(data.get('amount', 0))
-        location = data.get('location', 'Unknown')
-        user_id = data.get('sender_id') or data.get('user_id') or 'JUDGE_USER'
-        recipient_id = data.get('recipient_id') or data.get('receiver_id') or 'Unknown_Recipient'
-        txn_id = data.get('transaction_id') or f"JUDGE-{uuid.uuid4().hex[:8]}"
-        timestamp = data.get('timestamp')
-        
-        # Default timestamp if not provided
-        from datetime import datetime
-        if not timestamp:
-            timestamp = datetime.now().isoformat()
-        
         # Create a full transaction record
-        row_dict = {
-            'transaction_id': txn_id,
-            'user_id': user_id,
-            'recipient_id': recipient_id,
-            'amount': amount,
-            'location': location,
-            'timestamp': timestamp
-        }
-        
-        # Convert to DataFrame row for processing (some utils expect DF context)
-        # We use the global DF as context
-        context_df = global_model_context.get('df', pd.DataFrame([row_dict]))
-        
-        # 1. Rule Check
-        single_df = pd.DataFrame([row_dict])
-        
-        # Add to context to allow history-based rules (Burst, Travel)
-        augmented_df = pd.concat([context_df, single_df], ignore_index=True)
-        
-        preprocessor = Preprocessor()
-        augmented_df = preprocessor.clean_data(augmented_df)
-        
-        ddie = DDIE()
-        # Apply rules to WHOLE history to catch time/location gaps
-        all_rule_results = ddie.apply_rules(augmented_df)
-        
-        # Extract result for the LAST row (the one we are judging)
-        rule_results = all_rule_results.iloc[[-1]]
-        rule_score = rule_results.iloc[0]['rule_score']
-        reasons = rule_results.iloc[0]['reasons']
-        
-        # SAVE history for next time (So the 2nd burst click sees the 1st)
-        global_model_context['df'] = augmented_df
-        
-        # 2. Graph Check (Use the already cleaned augmented_df)
-        graph_score = 0.0
-        graph_reasons = []
-        node_path = None
-        try:
-            graph_detector = GraphAnomalyDetector()
-            g_scores, g_reasons_list, g_node_paths = graph_detector.detect_anomalies(augmented_df)
-            
-            if g_scores:
-                # The last transaction is the one we just added
-                graph_score = g_scores[-1]
-                graph_reasons = g_reasons_list[-1]
-                node_path = g_node_paths[-1]
-        except Exception as e:
-            logger.error(f"Judge Graph Error: {e}")
-
-        # 3. ML Score
-        uaic = global_model_context.get('uaic')
-        ml_score = 0.0
-        if uaic and uaic.model:
-            ml_score = uaic.predict_single(row_dict, context_df)
-            
-        # 3. Hybrid Score
-        scorer = global_model_context.get('scorer')
-        if not scorer:
-            scorer = HybridScorer() # Fallback
-            
-        final_score = scorer.compute_hybrid_score(rule_score, ml_score, graph_score)
-        
-        # Override for Judge Mode: Make it extremely sensitive to impress judges
-        # If any hard rule triggered OR any Graph Anomaly found, its an Anomaly.
-        any_reasons = (len(reasons) > 0 and rule_score > 0) or (len(graph_reasons) > 0)
-        
-        if any_reasons or graph_score > 0.2:
-            final_score = max(final_score, 0.92) # Force very high score for demonstration
-            is_anomalous = True
-            # Merge reasons
-            reasons = list(set(reasons + graph_reasons))
+        row_dict = judge_record(request.json)
+        uaic, scorer, explainer = judge_models()
+
+        # Only the new row is cleaned; the history already lives in the session's state
+        single_df = Preprocessor().clean_data(pd.DataFrame([row_dict]))
+        judged = single_df.iloc[0]
+
+        # Everything that reads or updates the session's history runs under its
+        # lock, so concurrent calls in one session cannot lose each other's rows
+        with judge_sessions.session(judge_session_id()) as state:
+            # Stage skips are counted per session
+            budget.skips = state.stage_skips
+
+            # 1. Rule Check: replays against the ID registry, history rules (Burst,
+            # Travel) against the user's recent transactions
+            rule_score, reasons = state.check_rules(single_df)
+
+            # 2. ML Score (user frequency from the running per-user counts)
+            ml_score = 0.0
+            user_freqs = state.user_frequency(row_dict['user_id'])
+            if uaic and uaic.model:
+                ml_score = uaic.predict_single(row_dict, precomputed_freqs=user_freqs)
+
+            # 3. Graph Check: add the new (cleaned) edge to the persistent history graph
+            graph_score = 0.0
+            graph_reasons = []
+            node_path = None
+            try:
+                graph_score, graph_reasons, node_path = judge_graph_edge(state, budget, judged)
+            except Exception as e:
+                logger.error(f"Judge Graph Error: {e}")
+
+            # 4. Hybrid Score
+            final_score, is_anomalous, reasons = judge_verdict(scorer, rule_score, reasons, ml_score,
+                                                               graph_score, graph_reasons)
+
+            # Context stats for comparison, from the running aggregates
+            context_stats = state.global_stats()
+
+            # SAVE the transaction and its verdict (So the 2nd burst click sees the 1st)
+            state.record(judged.to_dict(), is_anomalous, float(final_score))
+
+        # 5. Explanation Generation (outside the session lock); without the
+        # row's features it is built from the rules and graph alone, no SHAP
+        if is_anomalous and uaic and uaic.model and budget.allows('shap_explanation'):
+            row_features = uaic._create_features_single(row_dict, precomputed_freqs=user_freqs)
+            with budget.timed('shap_explanation'):
+                explanation = explainer.generate_explanation(reasons, ml_score, row_features, uaic.model, is_anomalous, row=row_dict, global_stats=context_stats, graph_reasons=graph_reasons)
         else:
-            is_anomalous = bool(scorer.is_anomalous(final_score))
-        
-        # 4. Explanation Generation
-        explainer = global_model_context.get('explainer')
-        if not explainer:
-            explainer = Explain()
-            
-        row_features = None
-        if uaic and uaic.model:
-             row_features = uaic._create_features_single(row_dict, context_df)
-             
-        # Compute context stats for comparison
-        from utils.ssg import SSG
-        ssg = SSG()
-        context_stats = ssg.compute_global_stats(context_df)
-        
-        explanation = explainer.generate_explanation(reasons, ml_score, row_features, uaic.model if uaic else None, is_anomalous, row=row_dict, global_stats=context_stats, graph_reasons=graph_reasons)
-
-        # SAVE results back to the dataframe so history reflects reality
-        idx = global_model_context['df'].index[-1]
-        global_model_context['df'].at[idx, 'is_anomalous'] = is_anomalous
-        global_model_context['df'].at[idx, 'final_score'] = float(final_score)
-
-        return jsonify({
-            'is_anomalous': is_anomalous,
-            'final_score': float(final_score),
-            'explanation': explanation,
-            'details': {
-                'rule_score': float(rule_score),
-                'ml_score': float(ml_score),
-                'graph_score': float(graph_score),
-                'weights': {
-                    'rule': scorer.rule_weight,
-                    'ml': scorer.ml_weight,
-                    'graph': scorer.graph_weight
-                },
-                'threshold': scorer.threshold,
-                'node_path': node_path
-            }
-        })
+            explanation = explainer.generate_explanation(reasons, ml_score, None, uaic.model if uaic else None, is_anomalous, row=row_dict, global_stats=context_stats, graph_reasons=graph_reasons)
+
+        response = judge_response(scorer, final_score, is_anomalous, explanation,
+                                  rule_score, ml_score, graph_score, node_path)
+        response['skipped_stages'] = budget.skipped
+        response['over_budget_stages'] = budget.over_budget
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"Judge error: {e}")
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/judge/batch', methods=['POST'])
+def judge_batch():
+    """
+    Judge a micro-batch of transactions: a JSON array of /api/judge payloads
+    (or {"transactions": [...]}). The batch is cleaned once, the rules run in
+    one vectorized pass and the ML model scores it in one call; the graph
+    scores each edge as it is added. Replays, user frequencies, the ML score
+    and the graph see the session history and the rows before each row, as
+    /api/judge one row at a time would. The burst and location rules check
+    the batch like a file analysis instead: a row is also compared with the
+    rows after it, so both transactions of a burst are flagged where single
+    calls flag only the second. Results come back in input order. A latency budget
+    covers the whole batch: once it runs short, the graph stages and SHAP
+    are skipped for the remaining rows, listed in each row's skipped_stages.
+    """
+    try:
+        budget = LatencyBudget(judge_stage_costs, judge_latency_budget())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        data = request.json
+        items = data.get('transactions') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return jsonify({'error': 'Expected a non-empty array of transactions'}), 400
+        if len(items) > JUDGE_MAX_BATCH:
+            return jsonify({'error': f'At most {JUDGE_MAX_BATCH} transactions per batch'}), 400
+
+        row_dicts = [judge_record(item) for item in items]
+        uaic, scorer, explainer = judge_models()
+        batch_df = Preprocessor().clean_data(pd.DataFrame(row_dicts))
+
+        with judge_sessions.session(judge_session_id()) as state:
+            # Stage skips are counted per session
+            budget.skips = state.stage_skips
+            rule_scores, reasons_list = state.check_rules_batch(batch_df)
+
+            # Each edge is scored as it is added, so a row sees the rows before it only
+            graph_scores = [0.0] * len(batch_df)
+            graph_reasons_list = [[] for _ in range(len(batch_df))]
+            node_paths = [None] * len(batch_df)
+            skipped_stages = [[] for _ in range(len(batch_df))]
+            over_budget_stages = [[] for _ in range(len(batch_df))]
+            for i, judged in enumerate(batch_df.to_dict('records')):
+                skipped_before, over_before = len(budget.skipped), len(budget.over_budget)
+                try:
+                    graph_scores[i], graph_reasons_list[i], node_paths[i] = judge_graph_edge(state, budget, judged)
+                except Exception as e:
+                    logger.error(f"Judge Graph Error: {e}")
+                skipped_stages[i].extend(budget.skipped[skipped_before:])
+                over_budget_stages[i].extend(budget.over_budget[over_before:])
+
+            # Each row's user frequency counts the rows before it, as if judged one by one
+            user_freqs = state.user_frequencies([row['user_id'] for row in row_dicts])
+            ml_scores = [0.0] * len(batch_df)
+            features = None
+            if uaic and uaic.model:
+                features = uaic._create_features(pd.DataFrame(row_dicts), user_freqs=user_freqs)
+                ml_scores = uaic.predict_batch(batch_df, features)
+
+            verdicts = [judge_verdict(scorer, rule_scores[i], reasons_list[i], ml_scores[i],
+                                      graph_scores[i], graph_reasons_list[i]) for i in range(len(batch_df))]
+
+            context_stats = state.global_stats()
+            for record, (final_score, is_anomalous, _) in zip(batch_df.to_dict('records'), verdicts):
+                state.record(record, is_anomalous, float(final_score))
+
+        results = []
+        for i, (final_score, is_anomalous, reasons) in enumerate(verdicts):
+            # As in /api/judge, SHAP only explains anomalous rows, and only while time is left
+            skipped_before, over_before = len(budget.skipped), len(budget.over_budget)
+            if is_anomalous and features is not None and budget.allows('shap_explanation'):
+                with budget.timed('shap_explanation'):
+                    explanation = explainer.generate_explanation(
+                        reasons, ml_scores[i], features[i], uaic.model, is_anomalous, row=row_dicts[i],
+                        global_stats=context_stats, graph_reasons=graph_reasons_list[i])
+            else:
+                explanation = explainer.generate_explanation(
+                    reasons, ml_scores[i], None, uaic.model if uaic else None, is_anomalous, row=row_dicts[i],
+                    global_stats=context_stats, graph_reasons=graph_reasons_list[i])
+            skipped_stages[i].extend(budget.skipped[skipped_before:])
+            over_budget_stages[i].extend(budget.over_budget[over_before:])
+            result = judge_response(scorer, final_score, is_anomalous, explanation,
+                                    rule_scores[i], ml_scores[i], graph_scores[i], node_paths[i])
+            result['transaction_id'] = row_dicts[i]['transaction_id']
+            result['skipped_stages'] = skipped_stages[i]
+            result['over_budget_stages'] = over_budget_stages[i]
+            results.append(result)
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        logger.error(f"Judge batch error: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/judge_history', methods=['GET'])
 def get_judge_history():
-    """Retrieve the current history of transactions analyzed in Judge Mode."""
+    """Retrieve the transactions analyzed so far in the caller's Judge Mode session."""
     try:
-        df = global_model_context.get('df')
-        if df is None:
-            return jsonify({'history': []})
-            
         # We need to return the transactions in a JSON serializable format
         history = []
-        for _, row in df.iterrows():
-            item = row.to_dict()
+        for record in judge_sessions.history(judge_session_id()):
+            item = dict(record)
             # Handle non-serializable objects if any
             for key, val in item.items():
                 if isinstance(val, pd.Timestamp):
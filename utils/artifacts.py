@@ -0,0 +1,218 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import sklearn
+
+from utils.ddie import DDIE
+from utils.graph_anomaly import GraphAnomalyDetector
+from utils.ingest import StreamingIngestor
+from utils.scoring import HybridScorer
+from utils.uaic import UAIC
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the files inside a version directory change shape
+ARTIFACT_FORMAT = 1
+
+
+def fit_judge_models(df, graph_backend='networkx'):
+    """
+    Fit the Judge Mode models on a cleaned transaction frame.
+    Returns (uaic, scorer, features); features is None when there are too
+    few rows to fit the ML model.
+    """
+    uaic = UAIC()
+    features = None
+    if len(df) >= 20:
+        features = uaic._create_features(df)
+        uaic.fit(df, features)
+
+    # Run initial analysis to get score distributions for auto-tuning
+    rule_results = DDIE().apply_rules(df)
+    ml_scores = uaic.predict_batch(df, features)
+    graph_scores, _, _ = GraphAnomalyDetector(backend=graph_backend).detect_anomalies(df)
+
+    scorer = HybridScorer()
+    scorer.auto_tune_threshold(rule_results['rule_score'].tolist(), ml_scores, graph_scores)
+    return uaic, scorer, features
+
+
+class ModelArtifactStore:
+    """
+    Versioned on-disk store for the fitted Judge Mode models.
+    Every save writes a new directory root/v<N> holding:
+      uaic.joblib    fitted UAIC (IsolationForest, StandardScaler, calibration)
+      shap.joblib    prebuilt SHAP TreeExplainer (optional)
+      features.npy   training feature matrix, the LIME/SHAP background data
+      manifest.json  version, creation time, library versions, feature names
+                     and the tuned HybridScorer weights/threshold
+    Arrays are loaded memory-mapped, so workers share pages instead of
+    refitting or copying the models on boot.
+    """
+
+    version_pattern = re.compile(r'^v(\d+)$')
+
+    def __init__(self, root='artifacts'):
+        self.root = root
+
+    def versions(self):
+        """Return the saved version numbers in ascending order."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            match = self.version_pattern.match(name)
+            if match and os.path.exists(os.path.join(self.root, name, 'manifest.json')):
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    def latest_version(self):
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def version_dir(self, version):
+        return os.path.join(self.root, f"v{version}")
+
+    def save(self, uaic, scorer, features=None, shap_explainer=None, source=None):
+        """
+        Write a new artifact version and return its number.
+        The manifest is written last, so a version without one is incomplete
+        and is ignored by versions()/load().
+        """
+        if uaic.model is None:
+            raise ValueError("Cannot save an unfitted UAIC model")
+
+        version = (self.latest_version() or 0) + 1
+        path = self.version_dir(version)
+        os.makedirs(path)
+        try:
+            joblib.dump(uaic, os.path.join(path, 'uaic.joblib'))
+            if shap_explainer is not None:
+                joblib.dump(shap_explainer, os.path.join(path, 'shap.joblib'))
+            if features is not None:
+                np.save(os.path.join(path, 'features.npy'), np.ascontiguousarray(features, dtype=np.float64))
+
+            manifest = {
+                'format': ARTIFACT_FORMAT,
+                'version': version,
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'source': source,
+                'sklearn_version': sklearn.__version__,
+                'numpy_version': np.__version__,
+                'feature_names': list(uaic.feature_names),
+                'training_rows': None if features is None else int(len(features)),
+                'scorer': {
+                    'rule_weight': scorer.rule_weight,
+                    'ml_weight': scorer.ml_weight,
+                    'graph_weight': scorer.graph_weight,
+                    'threshold': scorer.threshold
+                }
+            }
+            with open(os.path.join(path, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        logger.info(f"Saved model artifact v{version} to {path}")
+        return version
+
+    def load(self, version=None):
+        """
+        Load an artifact version (latest by default).
+        Returns a dict with uaic, scorer, features, shap_explainer and manifest,
+        or None when the store is empty.
+        """
+        version = version or self.latest_version()
+        if version is None:
+            return None
+
+        path = self.version_dir(version)
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported artifact format {manifest.get('format')} in {path}")
+        if manifest.get('sklearn_version') != sklearn.__version__:
+            logger.warning(f"Artifact v{version} was built with scikit-learn {manifest.get('sklearn_version')}, "
+                           f"running {sklearn.__version__}")
+
+        uaic = joblib.load(os.path.join(path, 'uaic.joblib'), mmap_mode='r')
+
+        features = None
+        features_path = os.path.join(path, 'features.npy')
+        if os.path.exists(features_path):
+            features = np.load(features_path, mmap_mode='r')
+
+        shap_explainer = None
+        shap_path = os.path.join(path, 'shap.joblib')
+        if os.path.exists(shap_path):
+            shap_explainer = joblib.load(shap_path, mmap_mode='r')
+
+        scorer = HybridScorer(**manifest['scorer'])
+        return {
+            'uaic': uaic,
+            'scorer': scorer,
+            'features': features,
+            'shap_explainer': shap_explainer,
+            'manifest': manifest
+        }
+
+
+def build(training_path, root='artifacts', with_shap=True):
+    """Fit the Judge Mode models on a training file and save them as a new version."""
+    df = StreamingIngestor().load(training_path)
+    if df.empty:
+        raise ValueError(f"No transactions in {training_path}")
+
+    uaic, scorer, features = fit_judge_models(df, os.environ.get('VIGILO_GRAPH_BACKEND', 'networkx'))
+    if uaic.model is None:
+        raise ValueError(f"Need at least 20 transactions to fit the model, got {len(df)}")
+
+    shap_explainer = None
+    if with_shap:
+        import shap
+        shap_explainer = shap.TreeExplainer(uaic.model)
+
+    return ModelArtifactStore(root).save(uaic, scorer, features, shap_explainer,
+                                         source=os.path.basename(training_path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.artifacts',
+                                     description='Manage versioned Judge Mode model artifacts.')
+    parser.add_argument('--root', default=os.environ.get('VIGILO_ARTIFACT_DIR', 'artifacts'),
+                        help='artifact directory (default: $VIGILO_ARTIFACT_DIR or ./artifacts)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='fit models on a training file and save a new version')
+    build_parser.add_argument('training_file', help='CSV, Parquet or Arrow file of transactions')
+    build_parser.add_argument('--no-shap', action='store_true', help='do not prebuild the SHAP explainer')
+
+    commands.add_parser('list', help='list saved versions')
+
+    args = parser.parse_args(argv)
+    store = ModelArtifactStore(args.root)
+
+    if args.command == 'build':
+        version = build(args.training_file, args.root, with_shap=not args.no_shap)
+        print(f"Built artifact v{version} in {store.version_dir(version)}")
+    elif args.command == 'list':
+        for version in store.versions():
+            with open(os.path.join(store.version_dir(version), 'manifest.json')) as f:
+                manifest = json.load(f)
+            print(f"v{version}  {manifest['created_at']}  rows={manifest['training_rows']}  "
+                  f"threshold={manifest['scorer']['threshold']}  source={manifest['source']}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import pandas as pd
 from dateutil import parser
 import numpy as np
+from utils.preprocess import as_datetime64
 
 class DDIE:
     """
@@ -8,7 +9,10 @@ class DDIE:
     Performs strict validation using rules for obvious errors.
     """
 
-    def __init__(self):
+    def __init__(self, registry=None):
+        # Optional TransactionRegistry shared across calls (Judge Mode), so IDs
+        # seen in earlier batches are caught as replays.
+        self.registry = registry
         self.rules = {
             'duplicate_detection': self._check_duplicates,
             'timestamp_violations': self._check_timestamps,
@@ -17,10 +21,54 @@ class DDIE:
             'time_gap_anomalies': self._check_time_gaps,
             'location_conflicts': self._check_location_conflicts
         }
+        # Columnar counterparts of self.rules: each takes the whole frame plus a
+        # shared context and returns (scores array, reasons array) for every row.
+        self.vector_rules = {
+            'duplicate_detection': self._check_duplicates_vectorized,
+            'timestamp_violations': self._check_timestamps_vectorized,
+            'amount_anomalies': self._check_amounts_vectorized,
+            'missing_fields': self._check_missing_fields_vectorized,
+            'time_gap_anomalies': self._check_time_gaps_vectorized,
+            'location_conflicts': self._check_location_conflicts_vectorized
+        }
 
-    def apply_rules(self, df):
+    def apply_rules(self, df, vectorized=True, rules=None):
         """
         Apply all rules to the dataframe and return rule scores and reasons.
+        The vectorized mode evaluates each rule over whole columns at once;
+        pass vectorized=False to fall back to the original row-by-row engine.
+        `rules` optionally restricts the run to a subset of rule names.
+        """
+        if not vectorized:
+            return self._apply_rules_rowwise(df, rules)
+
+        n = len(df)
+        if n == 0:
+            return pd.DataFrame(columns=['index', 'rule_score', 'reasons'])
+
+        context = self._build_context(df)
+        total = np.zeros(n)
+        reason_columns = []
+        for rule_name, rule_func in self.vector_rules.items():
+            if rules is not None and rule_name not in rules:
+                continue
+            scores, reasons = rule_func(df, context)
+            total += scores
+            reason_columns.append(reasons)
+
+        # Normalize rule_score to 0-1
+        total = np.minimum(total, 1.0)
+        reasons_per_row = [[r for r in row_reasons if r] for row_reasons in zip(*reason_columns)]
+
+        return pd.DataFrame({
+            'index': df.index,
+            'rule_score': total,
+            'reasons': reasons_per_row
+        })
+
+    def _apply_rules_rowwise(self, df, rules=None):
+        """
+        Original engine: evaluate every rule for every row against the full frame.
         """
         results = []
         for idx, row in df.iterrows():
@@ -28,6 +76,8 @@ class DDIE:
             reasons = []
 
             for rule_name, rule_func in self.rules.items():
+                if rules is not None and rule_name not in rules:
+                    continue
                 score, reason = rule_func(row, df)
                 rule_score += score
                 if reason:
@@ -60,6 +110,8 @@ class DDIE:
 
     def _check_timestamps(self, row, df):
         """Check for impossible or future timestamps."""
+        if row.get('timestamp_invalid', False) == True:
+            return 0.6, "Broken Time: Date format is unreadable"
         if 'timestamp' in row and pd.notna(row['timestamp']):
             try:
                 # Robust parsing
@@ -154,19 +206,16 @@ class DDIE:
                 # Parse and sort
                 user_txns = user_txns.copy()
                 user_txns['timestamp'] = pd.to_datetime(user_txns['timestamp'], errors='coerce')
-                user_txns = user_txns.sort_values('timestamp').dropna(subset=['timestamp'])
-                
-                # Iterate to find conflict involving THIS row? 
-                # Actually, simpler to just detect if ANY conflict exists for the user. 
-                # But we should ideally return true only if THIS row is part of it.
-                # For simplicity/speed in demo, flagging the user is okay.
+                user_txns = user_txns.sort_values('timestamp', kind='mergesort').dropna(subset=['timestamp'])
                 
+                # Only pairs of consecutive transactions that include THIS row count,
+                # so the rest of the user's history is not flagged with it.
                 for i in range(len(user_txns) - 1):
                      t1 = user_txns.iloc[i]
                      t2 = user_txns.iloc[i+1]
                      
-                     # Check if at least one is the current row? 
-                     # Not strictly necessary for demo visuals, but technically correct.
+                     if row.name not in (t1.name, t2.name):
+                         continue
                      
                      loc1 = str(t1['location'])
                      loc2 = str(t2['location'])
@@ -178,3 +227,223 @@ class DDIE:
             except:
                 pass
         return 0.0, None
+
+    # --- Vectorized rules -------------------------------------------------
+
+    def _build_context(self, df):
+        """Parse the columns shared by several rules once per analysis."""
+        context = {}
+        if 'timestamp' in df.columns:
+            context['timestamps'] = as_datetime64(df['timestamp'])
+            if 'user_id' in df.columns:
+                context['user_index'] = UserTimeIndex(df['user_id'], context['timestamps'])
+        return context
+
+    def _check_duplicates_vectorized(self, df, context):
+        """Flag every occurrence of a transaction_id after its first one."""
+        scores = np.zeros(len(df))
+        reasons = np.full(len(df), None, dtype=object)
+        if 'transaction_id' not in df.columns:
+            return scores, reasons
+
+        txn_ids = df['transaction_id']
+        registry = self.registry if self.registry is not None else TransactionRegistry()
+        dup = registry.register(txn_ids)
+        if dup.any():
+            scores[dup] = 0.9
+            reasons[dup] = [f"Duplicate Transaction (Matches {t})" for t in txn_ids[dup]]
+        return scores, reasons
+
+    def _check_timestamps_vectorized(self, df, context):
+        """Flag unreadable and future timestamps."""
+        scores = np.zeros(len(df))
+        reasons = np.full(len(df), None, dtype=object)
+        if 'timestamp' not in df.columns:
+            return scores, reasons
+
+        present = df['timestamp'].notna().to_numpy()
+        ts = context['timestamps']
+        broken = present & ts.isna().to_numpy()
+        if 'timestamp_invalid' in df.columns:
+            # Set by Preprocessor for values it had to replace
+            broken |= df['timestamp_invalid'].eq(True).to_numpy()
+        scores[broken] = 0.6
+        reasons[broken] = "Broken Time: Date format is unreadable"
+
+        now = pd.Timestamp.now().replace(tzinfo=None)
+        ahead = (ts - now).dt.total_seconds().to_numpy()
+        future = present & (ahead > 0)
+        scores[future] = np.where(ahead[future] > 86400, 0.9, 0.8)
+        reasons[future] = "Future Date Transaction"
+        return scores, reasons
+
+    def _check_amounts_vectorized(self, df, context):
+        """Flag negative, zero, or extreme amounts."""
+        scores = np.zeros(len(df))
+        reasons = np.full(len(df), None, dtype=object)
+        if 'amount' not in df.columns:
+            return scores, reasons
+
+        amounts = pd.to_numeric(df['amount'], errors='coerce').to_numpy(dtype=float)
+        non_positive = amounts <= 0
+        extreme = amounts > 1000000
+        scores[non_positive] = 0.9
+        reasons[non_positive] = "Negative/Zero Amount Transaction"
+        scores[extreme] = 0.7
+        reasons[extreme] = "Extreme Wealth Alert: Amount is unusually high"
+        return scores, reasons
+
+    def _check_missing_fields_vectorized(self, df, context):
+        """Flag rows missing any mandatory field."""
+        n = len(df)
+        scores = np.zeros(n)
+        reasons = np.full(n, None, dtype=object)
+        mandatory_fields = ['transaction_id', 'user_id', 'amount', 'timestamp', 'location', 'recipient_id']
+
+        # Encode each row's missing fields as a bit pattern so the reason text is
+        # built once per distinct pattern instead of once per row.
+        pattern = np.zeros(n, dtype=np.int64)
+        for bit, field in enumerate(mandatory_fields):
+            missing = df[field].isna().to_numpy() if field in df.columns else np.ones(n, dtype=bool)
+            pattern |= missing.astype(np.int64) << bit
+
+        flagged = pattern > 0
+        if flagged.any():
+            scores[flagged] = 0.8
+            for code in np.unique(pattern[flagged]):
+                missing = [f for bit, f in enumerate(mandatory_fields) if code >> bit & 1]
+                reasons[pattern == code] = f"Incomplete File: Important identity details are missing ({', '.join(missing)})"
+        return scores, reasons
+
+    def _check_time_gaps_vectorized(self, df, context):
+        """Flag rows with another transaction of the same user within 2 seconds."""
+        scores = np.zeros(len(df))
+        reasons = np.full(len(df), None, dtype=object)
+        index = context.get('user_index')
+        if index is None:
+            return scores, reasons
+
+        # The window always contains the row itself, so a burst means > 1.
+        burst = index.window_counts(2) > 1
+        scores[burst] = 0.6
+        reasons[burst] = "Less than 2sec Transaction"
+        return scores, reasons
+
+    def _check_location_conflicts_vectorized(self, df, context):
+        """Flag consecutive transactions of a user in different locations less than 10 minutes apart."""
+        scores = np.zeros(len(df))
+        reasons = np.full(len(df), None, dtype=object)
+        index = context.get('user_index')
+        if index is None or 'location' not in df.columns:
+            return scores, reasons
+
+        locations = df['location'].map(str).to_numpy(dtype=object)
+        first, second, gap_seconds = index.adjacent_pairs()
+        loc1, loc2 = locations[first], locations[second]
+        jump = (loc1 != loc2) & (loc1 != 'unknown') & (loc2 != 'unknown') & (np.abs(gap_seconds) < 600)
+
+        flagged = np.zeros(len(df), dtype=bool)
+        flagged[first[jump]] = True
+        flagged[second[jump]] = True
+        flagged &= pd.Series(locations).str.lower().to_numpy() != 'unknown'
+        scores[flagged] = 0.7
+        reasons[flagged] = "Impossible Location Jump"
+        return scores, reasons
+
+
+class TransactionRegistry:
+    """
+    Hash map of transaction_id -> position of its first occurrence.
+    A fresh registry gives linear-time duplicate detection for one batch; a
+    registry kept across batches (Judge Mode) also catches replayed IDs from
+    earlier batches with one lookup per row.
+    """
+
+    def __init__(self):
+        self.first_index = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.first_index)
+
+    def __contains__(self, txn_id):
+        return txn_id in self.first_index
+
+    def register(self, txn_ids):
+        """
+        Record a batch of IDs and return a boolean array marking every row
+        whose ID was already seen, earlier in this batch or in a previous one.
+        """
+        txn_ids = pd.Series(txn_ids).reset_index(drop=True)
+        present = txn_ids.notna().to_numpy()
+        repeated = txn_ids.duplicated(keep='first').to_numpy()
+        if self.first_index:
+            seen_before = txn_ids.map(lambda t: t in self.first_index).to_numpy(dtype=bool)
+        else:
+            seen_before = np.zeros(len(txn_ids), dtype=bool)
+
+        new = present & ~repeated & ~seen_before
+        positions = np.flatnonzero(new) + self.count
+        self.first_index.update(zip(txn_ids[new], positions.tolist()))
+        self.count += len(txn_ids)
+
+        return present & (repeated | seen_before)
+
+
+class UserTimeIndex:
+    """
+    Per-user sorted view of transaction times, built once per analysis.
+    Rows are ordered by (user, timestamp) so per-user windows become binary
+    searches and consecutive transactions of a user are adjacent entries.
+    Rows without a user or a readable timestamp are left out of the index.
+    """
+
+    def __init__(self, users, timestamps):
+        codes = pd.factorize(users.reset_index(drop=True))[0]
+        times = timestamps.reset_index(drop=True).to_numpy()
+        self.size = len(codes)
+        self.unit = np.datetime_data(times.dtype)[0]
+
+        indexed = np.flatnonzero((codes >= 0) & ~np.isnat(times))
+        order = np.lexsort((times[indexed], codes[indexed]))
+        # rows[k] is the positional row of the k-th entry in (user, time) order
+        self.rows = indexed[order]
+        self.codes = codes[self.rows]
+        self.times = times[self.rows].view(np.int64)
+
+    def _ticks(self, seconds):
+        return int(np.timedelta64(seconds, 's') / np.timedelta64(1, self.unit))
+
+    def window_counts(self, seconds):
+        """
+        Number of transactions of the same user within +/- seconds of each row,
+        the row itself included. Rows outside the index get 0.
+        """
+        counts = np.zeros(self.size, dtype=np.int64)
+        if len(self.rows) == 0:
+            return counts
+
+        key_type = [('user', np.int64), ('time', np.int64)]
+        keys = np.empty(len(self.rows), dtype=key_type)
+        keys['user'], keys['time'] = self.codes, self.times
+
+        width = self._ticks(seconds)
+        lower = np.empty_like(keys)
+        lower['user'], lower['time'] = self.codes, self.times - width
+        upper = np.empty_like(keys)
+        upper['user'], upper['time'] = self.codes, self.times + width
+
+        counts[self.rows] = np.searchsorted(keys, upper, side='right') - np.searchsorted(keys, lower, side='left')
+        return counts
+
+    def adjacent_pairs(self):
+        """
+        Consecutive transactions of the same user as (first_rows, second_rows,
+        gap_seconds), where second follows first in time.
+        """
+        same_user = self.codes[1:] == self.codes[:-1]
+        first = self.rows[:-1][same_user]
+        second = self.rows[1:][same_user]
+        gaps = (self.times[1:] - self.times[:-1])[same_user]
+        return first, second, gaps / self._ticks(1)
+
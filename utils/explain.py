@@ -15,17 +15,21 @@ class Explain:
         self.lime_explainer = None
         self.feature_names = None
 
-    def setup_explainer(self, model, training_data, feature_names):
+    def setup_explainer(self, model, training_data, feature_names, shap_explainer=None):
         """
         Set up SHAP and LIME explainers with the trained model.
+        A prebuilt SHAP explainer (e.g. from a saved model artifact) is reused as is.
         """
         self.feature_names = feature_names
 
         # SHAP explainer for global feature importance
-        try:
-            self.shap_explainer = shap.TreeExplainer(model)
-        except:
-            self.shap_explainer = shap.Explainer(model, training_data)
+        if shap_explainer is not None:
+            self.shap_explainer = shap_explainer
+        else:
+            try:
+                self.shap_explainer = shap.TreeExplainer(model)
+            except:
+                self.shap_explainer = shap.Explainer(model, training_data)
 
         # LIME explainer for local explanations
         self.lime_explainer = lime.lime_tabular.LimeTabularExplainer(
@@ -62,7 +66,9 @@ class Explain:
         elif "travel" in r_text or "future" in r_text or "timestamp" in r_text:
             fraud_type = "Time/Location Logic Error"
         
-        # PRIORITY 3: Statistical Graph Signals (Stranger Danger)
+        # PRIORITY 3: Statistical Graph Signals (Mules, Stranger Danger)
+        elif "fan-in" in r_text or "fan-out" in r_text:
+            fraud_type = "Money Mule Network"
         elif "stranger" in r_text or any("Community" in r for r in all_reasons_merged):
             fraud_type = "Suspicious Network Jump"
         
@@ -112,7 +118,7 @@ class Explain:
                     cycle_desc = r.split(": ")[-1] if ": " in r else r
                     break
             
-            if "Ping-Pong" in r_text:
+            if "ping-pong" in r_text:
                 why_suspicious = "Money is bouncing back and forth rapidly between two accounts—a classic tactic to test transaction limits."
             else:
                 why_suspicious = f"A hidden money-cleansing ring was found. Funds are moving in a loop: {cycle_desc or 'moving through a closed circle to hide their origin.'}"
@@ -121,6 +127,14 @@ class Explain:
             # Display unique rule violations as a natural list
             unique_reasons = list(dict.fromkeys(reasons))
             why_suspicious = "The system blocked this because: " + ", ".join(unique_reasons) + "."
+
+        elif "fan-in" in r_text or "fan-out" in r_text:
+            patterns = []
+            if "fan-in" in r_text:
+                patterns.append("the receiving account collected funds from many different senders")
+            if "fan-out" in r_text:
+                patterns.append("the sending account paid out to many different recipients")
+            why_suspicious = f"Within a short time window, {' and '.join(patterns)}—typical of money mule accounts."
             
         elif top_factors:
              readable_factors = [f.replace('_', ' ') for f in top_factors]
@@ -145,16 +159,19 @@ class Explain:
         # 4. Confidence Score
         # If a deterministic rule/graph algo triggered, we are 100% confident.
         if all_reasons_merged: # Use all_reasons_merged to check if any rule/graph reason exists
-            confidence = "100.0"
+            confidence = "100.0%"
+        elif model is None:
+            # The ML stage did not run (no fitted model), so its score says nothing
+            confidence = "N/A (Rule Only)"
         else:
-            confidence = f"{ml_score * 100:.1f}" if ml_score > 0 else "N/A (Rule Only)"
+            confidence = f"{ml_score * 100:.1f}%"
         
         # 5. Build HTML
         html = f"""
         <div style="font-family: 'Inter', sans-serif; font-size: 0.9rem; line-height: 1.6;">
             <div style="margin-bottom: 5px;"><strong>Triggered Rule:</strong> <span style="color: #ff3b3b;">{triggered_rules_display}</span></div>
             <div style="margin-bottom: 5px;"><strong>Why Suspicious:</strong> {why_suspicious}</div>
-            <div style="margin-bottom: 5px;"><strong>Confidence:</strong> <b>{confidence}%</b></div>
+            <div style="margin-bottom: 5px;"><strong>Confidence:</strong> <b>{confidence}</b></div>
             <div style="margin-bottom: 5px;"><strong>Probable Type:</strong> <span style="background: rgba(255, 59, 59, 0.1); color: #ff3b3b; padding: 2px 6px; border-radius: 4px; font-weight: 600;">{fraud_type}</span></div>
         </div>
         """
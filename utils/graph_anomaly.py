@@ -1,41 +1,126 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
 import networkx as nx
 import community as community_louvain
 import numpy as np
 import pandas as pd
-from collections import defaultdict
+from utils.sparse_graph import SparseTransactionGraph, label_propagation
+
+logger = logging.getLogger(__name__)
+
+# Process pool shared by every parallel cycle search in this process (see start_cycle_pool)
+_cycle_pool = None
+_cycle_pool_workers = None
+_cycle_pool_lock = threading.Lock()
+# In a pool worker: (path, components) of the cycle components it loaded last
+_worker_components = (None, None)
 
 class GraphAnomalyDetector:
     """
     Graph-based anomaly detection for transactions.
-    Models transactions as directed graphs where accounts are nodes and transactions are edges.
-    Uses centrality measures and community detection to identify anomalous transactions.
+    Models transactions as directed graphs where accounts are nodes and transactions are edges,
+    held either in a NetworkX DiGraph (backend='networkx') or, for large networks, in a
+    SciPy CSR adjacency matrix over integer-coded accounts (backend='sparse').
+    Uses community detection and money-loop detection to identify anomalous transactions;
+    centrality measures are available on demand through centrality().
     """
 
-    def __init__(self):
+    # Longest money loop (in accounts) searched for
+    max_cycle_length = 6
+    # Largest share of the amount a hop of a money loop may drop (fees, skimming); each transfer
+    # passes on at most what came in. 0 only accepts loops of one unchanged amount
+    loop_amount_tolerance = 0.05
+    # Longest time from the first to the last transfer of a money loop (None: ignore timestamps)
+    cycle_window = pd.Timedelta(hours=24)
+    # Latest timed transfers kept per edge for the incremental loop check
+    edge_transfer_history = 16
+    # Incremental edges whose loop search may wait for a later call; past this, it runs anyway
+    max_deferred_edges = 100
+    # A transfer sent back within this time, within this relative amount difference, is a ping-pong
+    ping_pong_window = pd.Timedelta(hours=1)
+    ping_pong_tolerance = 0.1
+    # Distinct counterparties within one fan_window that mark a mule collecting (fan-in) or spraying (fan-out) money
+    fan_window = pd.Timedelta(hours=1)
+    fan_min_accounts = 10
+    # Accounts inside strongly connected components from which the cycle search uses a process pool
+    parallel_cycle_min_nodes = 50000
+    # Cycle search processes started by start_cycle_pool (None: one per CPU)
+    cycle_workers = None
+    # Source accounts sampled for approximate betweenness
+    centrality_sample_size = 256
+    # Edges added incrementally before communities are recomputed with Louvain: at least
+    # community_refresh_edges, and community_refresh_ratio per account so that the refresh
+    # (which covers the whole graph) costs a constant amount per edge on average
+    community_refresh_edges = 50
+    community_refresh_ratio = 0.5
+    # Above this many accounts, communities come from label propagation instead of Louvain
+    louvain_max_nodes = 20000
+
+    backends = ('networkx', 'sparse')
+
+    def __init__(self, backend='networkx', loop_amount_tolerance=None):
+        if backend not in self.backends:
+            raise ValueError(f"Unknown graph backend: {backend} (expected one of {', '.join(self.backends)})")
+        self.backend = backend
+        if loop_amount_tolerance is not None:
+            if not 0 <= loop_amount_tolerance < 1:
+                raise ValueError(f"loop_amount_tolerance must be in [0, 1), got {loop_amount_tolerance}")
+            self.loop_amount_tolerance = loop_amount_tolerance
         self.graph = None
+        self.sparse = None
+        # Bumped on every graph change; keys the cached graph measures
+        self.graph_version = 0
         self.centrality_scores = {}
+        self._centrality_cache = {}
         self.edge_weights = {}
+        self.edge_amounts = {}
+        self.edge_counts = {}
+        self.transactions = None
         self.communities = {}
+        # Last computed partition (communities also holds labels inherited since)
+        self._partition = {}
+        # Accounts with edges added since the last computed partition
+        self._touched = set()
+        self._communities_version = None
+        self._edges_since_communities = 0
+        # Label for the next community started by two new accounts
+        self._next_community_id = 0
         self.edge_to_cycle_map = {}
         self.edge_to_nodes_map = {}
+        # Loops recorded so far, by their rotation from the lowest account
+        self._recorded_cycles = set()
+        # Incremental edges whose loop search was deferred (add_transaction(defer=True))
+        self._deferred_edges = []
+        # {(sender, receiver): (times, amounts)} of the latest timed transfers per
+        # edge, times as int64 ns in order; built from transactions on first use
+        self._edge_transfers = None
+        # ({receiver: {sender: last time}}, {sender: {receiver: last time}}) for the incremental
+        # fan-in/fan-out counts, oldest first and within fan_window; built on first use
+        self._fan_counterparties = None
 
-    def _build_graph(self, df):
+    def _resolve_columns(self, df):
         """
-        Build a directed graph from transaction data.
-        Nodes: accounts (unique senders and receivers)
-        Edges: transactions with weights based on amount and frequency
+        Identify the sender, receiver and amount columns (Smart detection).
+        Assumes 'sender', 'receiver', 'amount' style names, else falls back to the first columns.
         """
-        self.graph = nx.DiGraph()
-
-        # Identify columns (assume 'sender', 'receiver', 'amount' or fallback to first three columns)
-        # Identify columns (Smart detection)
         possible_senders = ['user_id', 'sender', 'source', 'origin_account']
         possible_receivers = ['recipient_id', 'receiver', 'recipient', 'target', 'destination_account']
-        
+
         sender_col = next((c for c in possible_senders if c in df.columns), df.columns[0])
         # If receiver column not found, try to find a column that isn't sender, amount, tx_id, time
         receiver_col = next((c for c in possible_receivers if c in df.columns), None)
-        
+
         if receiver_col is None:
              # Fallback: using column 1 if it's not sender, else column 2
              if len(df.columns) > 1 and df.columns[1] != sender_col:
@@ -46,70 +131,883 @@ class GraphAnomalyDetector:
                  receiver_col = df.columns[-1] # Desperate fallback
 
         amount_col = 'amount' if 'amount' in df.columns else (df.columns[2] if len(df.columns) > 2 else None)
+        return sender_col, receiver_col, amount_col
 
-        # Add nodes
-        all_accounts = set(df[sender_col].dropna()) | set(df[receiver_col].dropna())
-        self.graph.add_nodes_from(all_accounts)
+    @staticmethod
+    def _normalize_accounts(values):
+        """
+        Case-insensitive account keys (str(value).strip().lower()) for a column.
+        Normalization runs once per distinct value, not once per transaction;
+        missing values keep their str() spelling ('nan') as before.
+        """
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        normalized = np.array([str(v).strip().lower() for v in uniques], dtype=object)
+        return normalized[codes]
 
-        # Add edges with weights
-        # Add edges with weights
-        edge_counts = defaultdict(int)
-        self.edge_amounts = defaultdict(float)
+    def _transaction_frame(self, df):
+        """
+        One row per transaction (in df order) with normalized sender/receiver, amount and time.
+        """
+        sender_col, receiver_col, amount_col = self._resolve_columns(df)
+        if amount_col:
+            amounts = pd.to_numeric(df[amount_col], errors='coerce').to_numpy(dtype=float)
+            amounts = np.where(np.isnan(amounts), 1.0, amounts)
+        else:
+            amounts = np.ones(len(df))
 
-        for _, row in df.iterrows():
-            sender = str(row[sender_col]).strip().lower() # Case-insensitive demo
-            receiver = str(row[receiver_col]).strip().lower()
-            amount = float(row[amount_col]) if amount_col and pd.notna(row[amount_col]) else 1.0
+        return pd.DataFrame({
+            'sender': self._normalize_accounts(df[sender_col]),
+            'receiver': self._normalize_accounts(df[receiver_col]),
+            'amount': amounts,
+            'time': self._transaction_times(df)
+        })
 
-            if sender and receiver:
-                edge_counts[(sender, receiver)] += 1
-                self.edge_amounts[(sender, receiver)] += amount
+    @staticmethod
+    def _transaction_times(df):
+        """
+        Transaction times as datetime64[ns]; NaT where unknown (no timestamp
+        column, or a value the Preprocessor flagged as unreadable).
+        """
+        if 'timestamp' not in df.columns:
+            return np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+        times = df['timestamp']
+        if not pd.api.types.is_datetime64_any_dtype(times):
+            times = pd.to_datetime(times, errors='coerce', format='mixed')
+        if times.dt.tz is not None:
+            times = times.dt.tz_convert(None)
+        times = times.to_numpy('datetime64[ns]')
+        if 'timestamp_invalid' in df.columns:
+            times = np.where(df['timestamp_invalid'].eq(True).to_numpy(), np.datetime64('NaT'), times)
+        return times
 
-        for (sender, receiver), count in edge_counts.items():
-            total_amount = self.edge_amounts[(sender, receiver)]
-            # Weight combines frequency and total amount (normalized)
-            weight = count * np.log1p(abs(total_amount))
-            self.graph.add_edge(sender, receiver, weight=weight)
-            self.edge_weights[(sender, receiver)] = weight
+    def _build_graph(self, df):
+        """
+        Build a directed graph from transaction data.
+        Nodes: accounts (unique normalized senders and receivers)
+        Edges: sender -> receiver pairs with weights based on amount and frequency
+        """
+        self.graph_version += 1
+        self.transactions = self._transaction_frame(df)
+        # A rebuilt graph shares nothing with the previous partition
+        self.communities = {}
+        self._partition = {}
+        self._touched = set()
+        self._edges_since_communities = 0
+        self._next_community_id = 0
+        self._edge_transfers = None
+        self._fan_counterparties = None
+
+        # Aggregate transactions into one edge per (sender, receiver) pair
+        tx = self.transactions
+        linked = tx[(tx['sender'] != '') & (tx['receiver'] != '')]
+        edges = linked.groupby(['sender', 'receiver'], sort=False)['amount'].agg(['size', 'sum'])
+
+        # Weight combines frequency and total amount (normalized)
+        weights = edges['size'] * np.log1p(edges['sum'].abs())
+
+        if self.backend == 'sparse':
+            # Edge data lives in the matrices; no per-edge Python dicts
+            self.graph = None
+            self.edge_amounts = {}
+            self.edge_weights = {}
+            self.edge_counts = {}
+            self.sparse = SparseTransactionGraph(edges.index.get_level_values('sender'),
+                                                 edges.index.get_level_values('receiver'),
+                                                 weights.to_numpy(), edges['sum'].to_numpy())
+            return
+
+        self.graph = nx.DiGraph()
+        self.sparse = None
+        self.edge_amounts = dict(zip(edges.index, edges['sum'].tolist()))
+        self.edge_weights = dict(zip(edges.index, weights.tolist()))
+        self.edge_counts = dict(zip(edges.index, edges['size'].tolist()))
+        self.graph.add_weighted_edges_from(
+            (sender, receiver, weight) for (sender, receiver), weight in self.edge_weights.items()
+        )
+
+    def centrality(self, approximate=False, k=None):
+        """
+        Combined (degree + betweenness + eigenvector) / 3 centrality per account.
+        Computed only when asked for and cached per graph version. With
+        approximate=True, betweenness is estimated from k sampled source
+        accounts (default centrality_sample_size) instead of all of them.
+        """
+        if self.graph is None and self.sparse is None:
+            return {}
+        k = (k or self.centrality_sample_size) if approximate else None
+        graph_size = (self.sparse or self.graph).number_of_nodes()
+        if k is not None and k >= graph_size:
+            k = None  # sampling every account is the exact computation
+
+        key = (self.graph_version, k)
+        if key not in self._centrality_cache:
+            # Results for older graph versions can never be asked for again
+            self._centrality_cache = {cached: scores for cached, scores in self._centrality_cache.items()
+                                      if cached[0] == self.graph_version}
+            self._centrality_cache[key] = self._compute_centrality(k)
+
+        self.centrality_scores = self._centrality_cache[key]
+        return self.centrality_scores
 
-    def _compute_centrality(self):
+    def _compute_centrality(self, k=None):
         """
-        Compute centrality measures for nodes.
+        Compute centrality measures for nodes (betweenness sampled over k sources if given).
         """
+        # Path-based measures need NetworkX; the sparse backend converts on demand
+        graph = self.graph if self.sparse is None else self.sparse.to_networkx()
         try:
-            degree_cent = nx.degree_centrality(self.graph)
-            betweenness_cent = nx.betweenness_centrality(self.graph, weight='weight')
-            eigenvector_cent = nx.eigenvector_centrality_numpy(self.graph, weight='weight')
+            degree_cent = nx.degree_centrality(graph)
+            betweenness_cent = nx.betweenness_centrality(graph, k=k, weight='weight', seed=0 if k else None)
+            eigenvector_cent = nx.eigenvector_centrality_numpy(graph, weight='weight')
         except:
             # Fallback if centrality computation fails (e.g., disconnected graph)
-            degree_cent = nx.degree_centrality(self.graph)
-            betweenness_cent = {node: 0.0 for node in self.graph.nodes()}
-            eigenvector_cent = {node: 0.0 for node in self.graph.nodes()}
+            degree_cent = nx.degree_centrality(graph)
+            betweenness_cent = {node: 0.0 for node in graph.nodes()}
+            eigenvector_cent = {node: 0.0 for node in graph.nodes()}
 
         # Combine centrality measures
-        self.centrality_scores = {}
-        for node in self.graph.nodes():
+        centrality_scores = {}
+        for node in graph.nodes():
             combined_cent = (degree_cent.get(node, 0) +
                            betweenness_cent.get(node, 0) +
                            eigenvector_cent.get(node, 0)) / 3.0
-            self.centrality_scores[node] = combined_cent
+            centrality_scores[node] = combined_cent
+        return centrality_scores
 
     def _detect_communities(self):
         """
-        Detect communities using Louvain method.
+        Detect communities using Louvain method (label propagation above louvain_max_nodes).
+        The partition is cached per graph version. After incremental edges,
+        Louvain warm-starts from the previous partition instead of from scratch.
         """
+        if self._communities_version == self.graph_version:
+            return
+
         try:
-            # Convert to undirected for community detection
-            undirected_graph = self.graph.to_undirected()
-            partition = community_louvain.best_partition(undirected_graph, weight='weight')
-            self.communities = partition
+            if self.sparse is not None:
+                # Both methods run on the integer-coded symmetric weight matrix
+                accounts = self.sparse.accounts
+                if len(accounts) > self.louvain_max_nodes:
+                    labels = label_propagation(self.sparse.undirected())
+                    self.communities = dict(zip(accounts, labels.tolist()))
+                else:
+                    undirected_graph = nx.from_scipy_sparse_array(self.sparse.undirected())
+                    partition = community_louvain.best_partition(undirected_graph, weight='weight')
+                    self.communities = {accounts[node]: label for node, label in partition.items()}
+            else:
+                # Convert to undirected for community detection
+                undirected_graph = self.graph.to_undirected()
+                if undirected_graph.number_of_nodes() > self.louvain_max_nodes:
+                    nodes = list(undirected_graph)
+                    matrix = nx.to_scipy_sparse_array(undirected_graph, nodelist=nodes, weight='weight', format='csr')
+                    self.communities = dict(zip(nodes, label_propagation(matrix).tolist()))
+                else:
+                    # Zero-weight edges (zero-amount transfers) carry no modularity, and a
+                    # warm-started Louvain rejects them
+                    undirected_graph.remove_edges_from([(u, v) for u, v, w in undirected_graph.edges(data='weight')
+                                                        if w <= 0])
+                    partition = community_louvain.best_partition(undirected_graph, partition=self._warm_start(undirected_graph),
+                                                                 weight='weight')
+                    self.communities = partition
         except:
             # Fallback: assign all nodes to one community
-            self.communities = {node: 0 for node in self.graph.nodes()}
+            nodes = self.sparse.accounts if self.sparse is not None else self.graph.nodes()
+            self.communities = {node: 0 for node in nodes}
+        self._partition = dict(self.communities)
+        self._next_community_id = max(self._partition.values(), default=-1) + 1
+        self._touched = set()
+        self._communities_version = self.graph_version
+        self._edges_since_communities = 0
+
+    def _warm_start(self, graph):
+        """
+        Initial Louvain partition after incremental edges: the last computed
+        partition, with every account touched by a new edge in a community of
+        its own. Louvain only merges the communities it starts from, so
+        restarting the changed accounts lets it re-split around them; untouched
+        regions keep their labels. Returns None (cold start) after a full rebuild.
+        """
+        if not self._edges_since_communities or not self._partition:
+            return None
+        next_label = self._next_community_id
+        initial = {}
+        for node in graph:
+            if node in self._partition and node not in self._touched:
+                initial[node] = self._partition[node]
+            else:
+                initial[node] = next_label
+                next_label += 1
+        return initial
+
+    def community_refresh_interval(self):
+        """Incremental edges between two community refreshes at the current graph size."""
+        accounts = self.graph.number_of_nodes() if self.graph is not None else 0
+        return max(self.community_refresh_edges, int(self.community_refresh_ratio * accounts))
+
+    def community_refresh_due(self):
+        """Whether the next incremental edge would trigger a community refresh."""
+        return self._edges_since_communities + 1 >= self.community_refresh_interval()
+
+    def _update_communities(self, sender, receiver, refresh=True):
+        """
+        Keep community labels current after one incremental edge.
+        A new account joins its counterparty's community (two new accounts
+        start a new one); once community_refresh_interval() edges have been
+        added since the last run, Louvain refines the partition, warm-started
+        from these labels. refresh=False leaves a due refresh to a later edge.
+        """
+        self._touched.update((sender, receiver))
+        if sender not in self.communities and receiver not in self.communities:
+            self.communities[sender] = self.communities[receiver] = self._next_community_id
+            self._next_community_id += 1
+        elif sender not in self.communities:
+            self.communities[sender] = self.communities[receiver]
+        elif receiver not in self.communities:
+            self.communities[receiver] = self.communities[sender]
+
+        self._edges_since_communities += 1
+        if refresh and self._edges_since_communities >= self.community_refresh_interval():
+            self._detect_communities()
+        else:
+            # Current enough until the next refresh
+            self._communities_version = self.graph_version
+
+    def _find_cycles(self, components=None, window=None):
+        """
+        Yield (accounts, edge_amounts) for every simple cycle of 2..max_cycle_length accounts.
+        A cycle never leaves its strongly connected component, so the search
+        runs inside each non-trivial component only; accounts that cannot
+        reach back to themselves are never explored. With a window (in
+        nanoseconds), components come from _temporal_components and only
+        time-respecting cycles are found.
+        """
+        if components is None:
+            components = self._cycle_components()
+        for names, successors, predecessors, edges in components:
+            for cycle, cycle_amounts in self._component_cycles(successors, predecessors, edges, self.max_cycle_length,
+                                                               window, tolerance=self.loop_amount_tolerance):
+                yield [names[i] for i in cycle], cycle_amounts
+
+    def _cycle_components(self):
+        """
+        Yield (account names, successor lists, predecessor lists, {(i, j): amount})
+        for each strongly connected component of two or more accounts, with
+        accounts numbered by position in the names list.
+        """
+        if self.sparse is not None:
+            for nodes in self.sparse.strongly_connected_components():
+                yield (self.sparse.accounts[nodes], *self.sparse.component_adjacency(nodes))
+            return
+
+        for component in nx.strongly_connected_components(self.graph):
+            if len(component) < 2:
+                continue
+            subgraph = self.graph.subgraph(component)
+            names = list(subgraph)
+            position = {node: i for i, node in enumerate(names)}
+            successors = [[position[v] for v in subgraph.successors(u)] for u in names]
+            predecessors = [[position[v] for v in subgraph.predecessors(u)] for u in names]
+            amounts = {(position[u], position[v]): self.edge_amounts[(u, v)] for u, v in subgraph.edges()}
+            yield names, successors, predecessors, amounts
+
+    def _temporal_components(self, components):
+        """
+        Swap the edge amounts of cycle components for the transactions behind
+        each edge, as (spans, times, amounts): the component's transactions
+        sorted by edge then time (times as int64 ns), and {(i, j): (start, stop)}
+        locating each edge's run in them. Transactions without a known time
+        are left out.
+        """
+        components = list(components)
+        if not components:
+            return []
+
+        # Component and position of every account that can be on a cycle
+        accounts = pd.Index(np.concatenate([np.asarray(names, dtype=object) for names, *_ in components]))
+        sizes = [len(names) for names, *_ in components]
+        component_of = np.repeat(np.arange(len(components)), sizes)
+        position_of = np.concatenate([np.arange(size) for size in sizes])
+
+        tx = self.transactions
+        senders = accounts.get_indexer(tx['sender'])
+        receivers = accounts.get_indexer(tx['receiver'])
+        timed = np.flatnonzero((senders >= 0) & (receivers >= 0) & tx['time'].notna().to_numpy())
+        timed = timed[component_of[senders[timed]] == component_of[receivers[timed]]]
+
+        component = component_of[senders[timed]]
+        i = position_of[senders[timed]]
+        j = position_of[receivers[timed]]
+        times = tx['time'].to_numpy('datetime64[ns]')[timed].astype(np.int64)
+        order = np.lexsort((times, j, i, component))
+        component, i, j, times = component[order], i[order], j[order], times[order]
+        amounts = tx['amount'].to_numpy()[timed][order]
+
+        # One run of transactions per edge, one block of runs per component
+        runs = np.flatnonzero(np.r_[True, (component[1:] != component[:-1]) | (i[1:] != i[:-1]) | (j[1:] != j[:-1])])
+        blocks = np.searchsorted(component, np.arange(len(components) + 1))
+        run_blocks = np.searchsorted(runs, blocks)
+
+        temporal = []
+        for c, (names, successors, predecessors, _) in enumerate(components):
+            lo, hi = blocks[c], blocks[c + 1]
+            starts = runs[run_blocks[c]:run_blocks[c + 1]]
+            stops = np.r_[starts[1:], hi]
+            spans = dict(zip(zip(i[starts].tolist(), j[starts].tolist()),
+                             zip((starts - lo).tolist(), (stops - lo).tolist())))
+            temporal.append((names, successors, predecessors,
+                             (spans, times[lo:hi].tolist(), amounts[lo:hi].tolist())))
+        return temporal
+
+    def _find_money_loops_parallel(self, components, pool, workers, window=None):
+        """
+        Yield (accounts, edge_amounts) for every cycle that qualifies as a money
+        loop, searching the components in the shared process pool of workers
+        processes. Results come back in the same order as the serial search.
+        The components are pickled once to a temporary file that each worker
+        loads once, so tasks only carry component numbers and start ranges.
+        Falls back to the serial search if worker processes cannot be used.
+        """
+        tasks = self._cycle_tasks(components, workers)
+        path = None
+        try:
+            fd, path = tempfile.mkstemp(prefix='vigilo_cycles_', suffix='.pkl')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(components, f, protocol=pickle.HIGHEST_PROTOCOL)
+            search = partial(_search_cycle_tasks, path=path, max_length=self.max_cycle_length, window=window,
+                             tolerance=self.loop_amount_tolerance)
+            results = list(pool.map(search, tasks))
+        except (OSError, BrokenProcessPool) as e:
+            if isinstance(e, BrokenProcessPool):
+                _restart_cycle_pool(pool)
+            logger.warning(f"Parallel cycle search unavailable ({e}); searching serially")
+            yield from self._find_cycles(components, window)
+            return
+        finally:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+        for found in results:
+            yield from found
+
+    @staticmethod
+    def _cycle_tasks(components, workers):
+        """
+        Split components into about four similar-sized tasks per worker, as
+        lists of (component number, start, stop).
+        Small components are batched together; a component bigger than one task
+        is split into ranges of DFS start accounts (each start is searched
+        independently), so one giant component still spreads over the pool.
+        """
+        total = sum(len(component[0]) for component in components)
+        task_size = max(1, -(-total // (workers * 4)))
+        tasks, batch, batch_size = [], [], 0
+        for index, component in enumerate(components):
+            n = len(component[0])
+            if n > task_size:
+                if batch:
+                    tasks.append(batch)
+                    batch, batch_size = [], 0
+                for start in range(0, n, task_size):
+                    tasks.append([(index, start, min(start + task_size, n))])
+                continue
+            batch.append((index, 0, n))
+            batch_size += n
+            if batch_size >= task_size:
+                tasks.append(batch)
+                batch, batch_size = [], 0
+        if batch:
+            tasks.append(batch)
+        return tasks
+
+    @staticmethod
+    def _component_cycles(successors, predecessors, edges, max_length, window=None, starts=None, tolerance=0.05):
+        """
+        Yield (cycle, edge_amounts) for the cycles of one component, cycle as
+        node numbers. edges is {(i, j): amount} for the untimed search, or the
+        (spans, times, amounts) of _temporal_components for the time-respecting
+        one (window given), whose hops must keep within the amount tolerance.
+        """
+        if window is not None:
+            yield from GraphAnomalyDetector._temporal_cycles(successors, predecessors, edges, max_length, window, starts,
+                                                             tolerance)
+            return
+        for cycle in GraphAnomalyDetector._bounded_cycles(successors, predecessors, max_length, starts):
+            yield cycle, [edges[(cycle[i], cycle[(i + 1) % len(cycle)])] for i in range(len(cycle))]
+
+    @staticmethod
+    def _bounded_cycles(successors, predecessors, max_length, starts=None):
+        """
+        Depth-limited cycle search inside one strongly connected component,
+        given as integer successor/predecessor lists. Yields cycles as lists of
+        node numbers. Each cycle is enumerated once, from its lowest-numbered
+        account: the DFS from a start account only visits higher-numbered
+        accounts, and only those that can still get back to the start within
+        the hop budget (bounded reverse BFS distances), so work stays
+        proportional to the short cycles actually present rather than to all paths.
+        starts limits the search to cycles whose lowest-numbered account is in it.
+        """
+        for start in (starts if starts is not None else range(len(successors))):
+            # Hops needed to get back to start, for accounts numbered above it
+            distance = {start: 0}
+            frontier = [start]
+            for hops in range(1, max_length):
+                reached = []
+                for v in frontier:
+                    for u in predecessors[v]:
+                        if u > start and u not in distance:
+                            distance[u] = hops
+                            reached.append(u)
+                frontier = reached
+            if len(distance) == 1:
+                continue
+
+            path = [start]
+            on_path = {start}
+            stack = [iter(successors[start])]
+            while stack:
+                for w in stack[-1]:
+                    if w == start:
+                        if len(path) >= 2:  # self-transfers are not loops
+                            yield list(path)
+                    elif w in distance and w not in on_path and len(path) + distance[w] <= max_length:
+                        path.append(w)
+                        on_path.add(w)
+                        stack.append(iter(successors[w]))
+                        break
+                else:
+                    stack.pop()
+                    on_path.discard(path.pop())
+
+    @staticmethod
+    def _temporal_cycles(successors, predecessors, transfers, max_length, window, starts=None, tolerance=0.05):
+        """
+        Time-respecting cycle search inside one strongly connected component.
+        transfers is (spans, times, amounts) from _temporal_components. A loop
+        is a chain of transactions, each no earlier than the one before, that
+        gets back to its first account at most window nanoseconds after the
+        first transfer. A search opens on every transaction leaving a start
+        account; each hop takes the earliest transaction that keeps the chain
+        going, in time and in amount: it passes on no more than the transfer
+        before it and at least 1 - tolerance of it, as _is_money_loop requires
+        of an ordered loop (so a small unrelated transfer on an edge does not
+        hide a loop through a later one). Branches whose next transfer would
+        fall outside the window are cut as soon as they are reached. Chains that get past their second account are also cut
+        at accounts too many hops from the start over edges active within the
+        window. Yields (cycle, amounts of the transactions used).
+        starts limits the search to loops leaving from those accounts.
+        """
+        spans, times, amounts = transfers
+        keep = 1 - tolerance
+
+        def next_transfer(span, previous, deadline):
+            """Earliest transfer of an edge's span after transfer previous, by the deadline, that carries on its amount."""
+            for k in range(bisect_left(times, times[previous], *span), span[1]):
+                if times[k] > deadline:
+                    return None
+                if keep * amounts[previous] <= amounts[k] <= amounts[previous]:
+                    return k
+            return None
+
+        for start in (starts if starts is not None else range(len(successors))):
+            for first in successors[start]:
+                if first == start or (start, first) not in spans:
+                    continue
+                for first_k in range(*spans[(start, first)]):
+                    if not amounts[first_k] > 0:
+                        continue
+                    deadline = times[first_k] + window
+                    # Hops back to start, computed once a chain needs them
+                    distance = None
+                    path = [start, first]
+                    on_path = {start, first}
+                    used = [first_k]
+                    stack = [iter(successors[first])]
+                    while stack:
+                        u = path[-1]
+                        for w in stack[-1]:
+                            if w in on_path and w != start:
+                                continue
+                            span = spans.get((u, w))
+                            if span is None:
+                                continue
+                            k = next_transfer(span, used[-1], deadline)
+                            if k is None:
+                                continue
+                            if w == start:
+                                yield list(path), [amounts[t] for t in used] + [amounts[k]]
+                                continue
+                            if len(path) >= max_length:
+                                continue
+                            if distance is None:
+                                distance = GraphAnomalyDetector._return_distances(
+                                    predecessors, transfers, start, max_length, times[first_k], deadline)
+                            if w not in distance or len(path) + distance[w] > max_length:
+                                continue
+                            path.append(w)
+                            on_path.add(w)
+                            used.append(k)
+                            stack.append(iter(successors[w]))
+                            break
+                        else:
+                            stack.pop()
+                            on_path.discard(path.pop())
+                            used.pop()
+
+    @staticmethod
+    def _return_distances(predecessors, transfers, start, max_length, earliest, latest):
+        """
+        Hops needed to get back to start (bounded reverse BFS), over edges with
+        a transfer between earliest and latest; a loop inside that time span
+        cannot use any other.
+        """
+        spans, times, _ = transfers
+        distance = {start: 0}
+        frontier = [start]
+        for hops in range(1, max_length):
+            reached = []
+            for v in frontier:
+                for u in predecessors[v]:
+                    if u in distance or (u, v) not in spans:
+                        continue
+                    span = spans[(u, v)]
+                    k = bisect_left(times, earliest, *span)
+                    if k < span[1] and times[k] <= latest:
+                        distance[u] = hops
+                        reached.append(u)
+            frontier = reached
+        return distance
+
+    def _record_cycle(self, cycle, cycle_amounts, ordered=False):
+        """
+        Map each edge of a cycle to its description if the amounts flowing
+        around it (cycle_amounts[i] on edge cycle[i] -> cycle[i + 1]) are
+        conserved, i.e. the same money moving in a loop (see _is_money_loop).
+        A loop is recorded once, from its lowest account, however many of its
+        rotations and transfers the search found.
+        """
+        if self._is_money_loop(cycle_amounts, self.loop_amount_tolerance, ordered):
+            low = cycle.index(min(cycle))
+            cycle = list(cycle[low:]) + list(cycle[:low])
+            cycle_amounts = list(cycle_amounts[low:]) + list(cycle_amounts[:low])
+            if tuple(cycle) in self._recorded_cycles:
+                return
+            self._recorded_cycles.add(tuple(cycle))
+
+            avg_amt = sum(cycle_amounts) / len(cycle_amounts)
+            cycle_str = " -> ".join(str(n) for n in cycle) + " -> " + str(cycle[0])
+            cycle_str += f" (Avg Amount: {int(avg_amt)})"
+
+            nodes = [str(n) for n in cycle]
+            for i in range(len(cycle)):
+                u = cycle[i]
+                v = cycle[(i + 1) % len(cycle)]
+                self.edge_to_cycle_map[(u, v)] = cycle_str
+                self.edge_to_nodes_map[(u, v)] = nodes
+
+    @staticmethod
+    def _is_money_loop(cycle_amounts, tolerance=0.05, ordered=False):
+        """
+        True if the amounts around a cycle are all positive and conserved hop
+        by hop: each transfer passes on no more than the one before it, and at
+        least 1 - tolerance of it (a laundering loop moves the same money, less
+        fees; a dense transfer network also holds many short cycles of
+        unrelated amounts). ordered=True means cycle_amounts starts with the
+        first transfer in time; otherwise the loop may start at any of them.
+        """
+        amounts = np.asarray(cycle_amounts, dtype=float)
+        following = np.roll(amounts, -1)
+        broken = (following > amounts) | (following < (1 - tolerance) * amounts)
+        if ordered:
+            # The last hop closes the loop back to the first transfer
+            return bool(amounts.min() > 0 and not broken[:-1].any())
+        return bool(amounts.min() > 0 and broken.sum() <= 1)
+
+    def add_transaction(self, sender, receiver, amount, timestamp=None, defer=False, refresh=True):
+        """
+        Add one transaction to the graph built so far and score it.
+        Incremental path for Judge Mode: only the new edge is written, the
+        cycle check searches for paths from the receiver back to the sender
+        within max_cycle_length - 1 hops (any new loop must use the new edge),
+        and communities are refreshed lazily. The cost depends on the accounts
+        around the edge, not on the size of the history.
+        With a timestamp (and cycle_window set), a loop must be a chain of
+        transfers in time order that the new one closes within cycle_window,
+        as in detect_anomalies; without one, any path back closes a loop.
+        With defer=True (no time left for the search) the edge is only written
+        and scored from the communities and loops already known; its loop
+        search runs with the next full call. At most max_deferred_edges
+        searches wait (see can_defer); past that, defer is ignored. refresh=False (implied by defer)
+        likewise leaves a due community refresh to a later call.
+        A timed transfer is also checked for a ping-pong against the reverse
+        edge's transfers (see _bounced_back) and for fan-in/fan-out against
+        the counterparties its accounts dealt with in the last fan_window
+        (see _fan_counts).
+        Returns: (score, reasons_list, node_path)
+        """
+        sender, receiver, amount, time = self._add_edge(sender, receiver, amount, timestamp, defer, refresh)
+        ping_pong = fan_in = fan_out = False
+        if time is not None:
+            ping_pong = self._bounced_back(sender, receiver, amount, time)
+            fan_in, fan_out = self._fan_counts(sender, receiver, time)
+        score, reasons = self._compute_anomaly_score(sender, receiver, amount, ping_pong, fan_in, fan_out)
+        node_path = self.edge_to_nodes_map.get((sender, receiver))
+        if node_path is None and ping_pong:
+            node_path = [sender, receiver]
+        return score, reasons, node_path
+
+    def can_defer(self):
+        """Whether another incremental edge's loop search may be deferred."""
+        return len(self._deferred_edges) < self.max_deferred_edges
+
+    def _add_edge(self, sender, receiver, amount, timestamp=None, defer=False, refresh=True):
+        """
+        Write one incremental edge and record the loops it closes; returns the
+        normalized (sender, receiver, amount) and the time in ns (None if unknown).
+        """
+        if self.backend != 'networkx':
+            raise ValueError("Incremental updates need the networkx backend")
+        if self.graph is None:
+            self.graph = nx.DiGraph()
+
+        sender = str(sender).strip().lower()
+        receiver = str(receiver).strip().lower()
+        amount = float(amount) if pd.notna(amount) else 1.0
+        time = None
+        if timestamp is not None:
+            timestamp = pd.to_datetime(timestamp, errors='coerce')
+            if pd.notna(timestamp):
+                time = (timestamp.tz_convert(None) if timestamp.tzinfo else timestamp).as_unit('ns').value
+        # Loops ignore transfer times without a cycle_window
+        loop_time = time if self.cycle_window is not None else None
+
+        if sender and receiver:
+            edge = (sender, receiver)
+            self.edge_counts[edge] = self.edge_counts.get(edge, 0) + 1
+            self.edge_amounts[edge] = self.edge_amounts.get(edge, 0.0) + amount
+            # Weight combines frequency and total amount (normalized)
+            self.edge_weights[edge] = self.edge_counts[edge] * np.log1p(abs(self.edge_amounts[edge]))
+            self.graph.add_edge(sender, receiver, weight=self.edge_weights[edge])
+            self.graph_version += 1
+
+            if time is not None:
+                self._add_edge_transfer(edge, time, amount)
+
+            defer = defer and self.can_defer()
+            self._update_communities(sender, receiver, refresh=refresh and not defer)
+
+            if defer:
+                self._deferred_edges.append((sender, receiver, amount, loop_time))
+            else:
+                deferred, self._deferred_edges = self._deferred_edges, []
+                for args in deferred + [(sender, receiver, amount, loop_time)]:
+                    self._record_new_cycles(*args)
+        else:
+            time = None
+        return sender, receiver, amount, time
+
+    def _add_edge_transfer(self, edge, time, amount):
+        """Keep one timed transfer in the edge's history (the latest edge_transfer_history)."""
+        if self._edge_transfers is None:
+            self._edge_transfers = self._seed_edge_transfers()
+        times, amounts = self._edge_transfers.setdefault(edge, ([], []))
+        k = bisect_right(times, time)
+        times.insert(k, time)
+        amounts.insert(k, amount)
+        if len(times) > self.edge_transfer_history:
+            del times[0], amounts[0]
+
+    def _bounced_back(self, sender, receiver, amount, time):
+        """
+        Whether the transfer sender -> receiver at time (ns) is a ping-pong:
+        the nearest transfer receiver -> sender on either side of it is
+        within ping_pong_window and ping_pong_tolerance of the amount, as
+        _ping_pong checks in batch analysis.
+        """
+        if self.ping_pong_window is None or sender == receiver or not amount > 0:
+            return False
+        times, amounts = self._edge_transfers.get((receiver, sender), ((), ()))
+        window = int(pd.Timedelta(self.ping_pong_window).value)
+        # Nearest reverse transfer at or before the time, then at or after it
+        for k in (bisect_right(times, time) - 1, bisect_left(times, time)):
+            if 0 <= k < len(times) and abs(times[k] - time) <= window:
+                reverse = amounts[k]
+                if reverse > 0 and abs(amount - reverse) <= self.ping_pong_tolerance * max(amount, reverse):
+                    return True
+        return False
+
+    def _fan_counts(self, sender, receiver, time):
+        """
+        Note the transfer sender -> receiver at time (ns) and return (fan_in,
+        fan_out): whether the receiver took money from, or the sender paid,
+        fan_min_accounts or more distinct counterparties within fan_window up
+        to it. Judged one by one, the transfer that completes a burst and the
+        ones after it are flagged; batch analysis (_fan_bursts) also flags
+        the earlier transfers of the burst.
+        """
+        if self.fan_window is None:
+            return False, False
+        if self._fan_counterparties is None:
+            self._fan_counterparties = self._seed_fan_counterparties()
+        incoming, outgoing = self._fan_counterparties
+        window = int(pd.Timedelta(self.fan_window).value)
+        return (self._fan_count(incoming, receiver, sender, time, window) >= self.fan_min_accounts,
+                self._fan_count(outgoing, sender, receiver, time, window) >= self.fan_min_accounts)
+
+    @staticmethod
+    def _fan_count(latest, account, counterparty, time, window):
+        """
+        Record a transfer between account and counterparty in latest (see
+        _fan_counterparties) and return the account's distinct counterparties
+        within window of it. Counterparties are kept in order of their last
+        transfer, so those that fell out of the window are dropped from the
+        front; the cost is amortised constant for transfers judged in time order.
+        """
+        counterparties = latest.setdefault(account, OrderedDict())
+        counterparties[counterparty] = max(counterparties.pop(counterparty, time), time)
+        while counterparties:
+            first = next(iter(counterparties))
+            if counterparties[first] >= time - window:
+                break
+            del counterparties[first]
+        return len(counterparties)
+
+    def _seed_fan_counterparties(self):
+        """Incremental fan-in/fan-out counterparties of the transactions the graph was built from."""
+        incoming, outgoing = {}, {}
+        tx = self.transactions
+        if tx is None:
+            return incoming, outgoing
+        timed = tx[tx['time'].notna() & (tx['sender'] != '') & (tx['receiver'] != '')]
+        window = pd.Timedelta(self.fan_window)
+        for latest, account, counterparty in ((incoming, 'receiver', 'sender'), (outgoing, 'sender', 'receiver')):
+            last = timed.groupby([account, counterparty], sort=False)['time'].max().reset_index()
+            # Only counterparties within the window of the account's latest transfer can still count
+            last = last[last['time'] >= last.groupby(account)['time'].transform('max') - window]
+            last = last.sort_values('time', kind='stable')
+            times = last['time'].to_numpy('datetime64[ns]').astype(np.int64).tolist()
+            for key, other, when in zip(last[account].tolist(), last[counterparty].tolist(), times):
+                latest.setdefault(key, OrderedDict())[other] = when
+        return incoming, outgoing
 
-    def _compute_anomaly_score(self, sender, receiver, amount):
+    def _seed_edge_transfers(self):
+        """Per-edge timed transfer history of the transactions the graph was built from."""
+        transfers = {}
+        tx = self.transactions
+        if tx is None:
+            return transfers
+        timed = tx[tx['time'].notna() & (tx['sender'] != '') & (tx['receiver'] != '')].sort_values('time', kind='stable')
+        timed = timed.groupby(['sender', 'receiver'], sort=False).tail(self.edge_transfer_history)
+        times = timed['time'].to_numpy('datetime64[ns]').astype(np.int64).tolist()
+        for edge, time, amount in zip(zip(timed['sender'], timed['receiver']), times, timed['amount'].tolist()):
+            edge_times, edge_amounts = transfers.setdefault(edge, ([], []))
+            edge_times.append(time)
+            edge_amounts.append(amount)
+        return transfers
+
+    def _record_new_cycles(self, sender, receiver, amount, time=None):
+        """Record the loops closed by the transfer sender -> receiver (at time, in ns, if known)."""
+        if sender == receiver:
+            return
+        max_hops = self.max_cycle_length - 1
+        if time is None:
+            closing = self.edge_amounts[(sender, receiver)]
+            for path, path_amounts in self._return_paths(receiver, sender, max_hops, closing):
+                self._record_cycle(path, path_amounts + [closing])
+        else:
+            # The new transfer is the last of the chain, so the loop started within the window before it
+            earliest = time - int(pd.Timedelta(self.cycle_window).value)
+            for path, path_amounts in self._return_paths(receiver, sender, max_hops, amount, earliest, time):
+                self._record_cycle(path, path_amounts + [amount], ordered=True)
+
+    def _return_paths(self, source, target, max_hops, closing, earliest=None, latest=None):
+        """
+        Yield (path, amounts) for every simple path source -> ... -> target of
+        at most max_hops edges that can make a money loop (see _is_money_loop)
+        with the closing amount target -> source, amounts being the edge
+        totals along it. Only hops whose amount such a loop could hold are
+        followed, and bounded reverse BFS distances to the target prune every
+        branch that cannot arrive within the remaining hops, so dense
+        neighbourhoods of unrelated amounts are not enumerated.
+        With earliest/latest (int64 ns), a path is a chain of timed transfers
+        between the two, each no earlier than the one before and passing on
+        no more than it and at least 1 - loop_amount_tolerance of it, with the
+        closing transfer last; each hop takes the earliest transfer that keeps
+        the chain going, and amounts are those of the transfers used.
+        """
+        if not closing > 0:
+            return
+        timed = earliest is not None
+        keep = 1 - self.loop_amount_tolerance
+        # Amounts a loop through the closing transfer can hold (a timed loop only loses money)
+        low = closing if timed else closing * keep ** max_hops
+        high = closing / keep ** max_hops
+        transfers = {}
+        if timed:
+            if self._edge_transfers is None:
+                self._edge_transfers = self._seed_edge_transfers()
+            transfers = self._edge_transfers
+
+        def hop(u, v, after, previous):
+            """(arrival time, amount) of the hop u -> v that fits the loop, else None."""
+            if not timed:
+                amount = self.edge_amounts[(u, v)]
+                return (None, amount) if low <= amount <= high else None
+            times, amounts = transfers.get((u, v), ((), ()))
+            for k in range(bisect_left(times, after), len(times)):
+                if times[k] > latest:
+                    break
+                amount = amounts[k]
+                if (low <= amount <= high and (previous is None or keep * previous <= amount <= previous)
+                        and (v != target or closing >= keep * amount)):
+                    return times[k], amount
+            return None
+
+        distance = {target: 0}
+        frontier = [target]
+        for hops in range(1, max_hops):
+            reached = []
+            for v in frontier:
+                for u in self.graph.predecessors(v):
+                    if u not in distance and hop(u, v, earliest, None) is not None:
+                        distance[u] = hops
+                        reached.append(u)
+            frontier = reached
+
+        path = [source]
+        on_path = {source}
+        # Arrival time at each account of the path, and the amounts that got there
+        arrivals = [earliest]
+        path_amounts = []
+        stack = [iter(self.graph.successors(source))]
+        while stack:
+            u = path[-1]
+            for w in stack[-1]:
+                if w != target and (w not in distance or w in on_path or len(path) + distance[w] > max_hops):
+                    continue
+                found = hop(u, w, arrivals[-1], path_amounts[-1] if timed and path_amounts else None)
+                if found is None:
+                    continue
+                if w == target:
+                    yield path + [target], path_amounts + [found[1]]
+                    continue
+                path.append(w)
+                on_path.add(w)
+                arrivals.append(found[0])
+                path_amounts.append(found[1])
+                stack.append(iter(self.graph.successors(w)))
+                break
+            else:
+                stack.pop()
+                on_path.discard(path.pop())
+                arrivals.pop()
+                if path_amounts:
+                    path_amounts.pop()
+
+    def _compute_anomaly_score(self, sender, receiver, amount, ping_pong=False, fan_in=False, fan_out=False):
         """
         Compute anomaly score for a single transaction.
+        ping_pong is whether it bounced straight back (see _bounced_back),
+        fan_in/fan_out whether its accounts look like mules (see _fan_counts).
         Returns: (score, reasons_list)
         """
         # Ensure case-insensitive matching
@@ -135,6 +1033,17 @@ class GraphAnomalyDetector:
             cycle_desc = self.edge_to_cycle_map[(sender, receiver)]
             reasons.append("Circular Money Loop Detected")
 
+        if ping_pong:
+            score += 0.8
+            reasons.append("Ping-Pong Transfer Detected")
+
+        if fan_in or fan_out:
+            score += 0.5
+        if fan_in:
+            reasons.append("High Fan-In (Mule Collection)")
+        if fan_out:
+            reasons.append("High Fan-Out (Mule Distribution)")
+
         return min(score, 1.0), reasons
 
     def detect_anomalies(self, df):
@@ -147,79 +1056,248 @@ class GraphAnomalyDetector:
 
         # Build graph
         self._build_graph(df)
-        self._compute_centrality()
         self._detect_communities()
 
         # DETECT CYCLES (Money Laundering Loops)
         self.edge_to_cycle_map = {}
-        self.edge_to_nodes_map = {} 
-        try:
-            # Only run on reasonable size graphs to avoid hanging
-            if self.graph.number_of_nodes() < 2000:
-                # nx.simple_cycles is an iterator - do NOT use list() on it for large graphs
-                cycles_iter = nx.simple_cycles(self.graph)
-                limit = 0
-                for cycle in cycles_iter:
-                    limit += 1
-                    if limit > 5000: break # Early exit for performance
-
-                    if 2 <= len(cycle) <= 6: 
-                        cycle_amounts = []
-                        for i in range(len(cycle)):
-                            u = cycle[i]
-                            v = cycle[(i + 1) % len(cycle)]
-                            amt = self.edge_amounts.get((u, v), 0.0)
-                            cycle_amounts.append(amt)
-                        
-                        if not cycle_amounts: continue
-                        min_amt = min(cycle_amounts)
-                        max_amt = max(cycle_amounts)
-                        
-                        if min_amt > 0 and (min_amt / max_amt) > 0.3:
-                            avg_amt = sum(cycle_amounts) / len(cycle_amounts)
-                            cycle_str = " -> ".join(str(n) for n in cycle) + " -> " + str(cycle[0])
-                            cycle_str += f" (Avg Amount: {int(avg_amt)})"
-                            
-                            for i in range(len(cycle)):
-                                u = cycle[i]
-                                v = cycle[(i + 1) % len(cycle)]
-                                self.edge_to_cycle_map[(u, v)] = cycle_str
-                                self.edge_to_nodes_map[(u, v)] = [str(n) for n in cycle]
-        except Exception:
-            pass
-
-        # Identify columns
-        possible_senders = ['user_id', 'sender', 'source', 'origin_account']
-        possible_receivers = ['recipient_id', 'receiver', 'recipient', 'target', 'destination_account']
-        
-        sender_col = next((c for c in possible_senders if c in df.columns), df.columns[0])
-        receiver_col = next((c for c in possible_receivers if c in df.columns), None)
-        
-        if receiver_col is None:
-             receiver_col = df.columns[1] if len(df.columns) > 1 else df.columns[-1]
+        self.edge_to_nodes_map = {}
+        self._recorded_cycles = set()
+        self._deferred_edges = []
+        components = list(self._cycle_components())
+        # Loops must move forward in time when the transactions say when they happened
+        window = None
+        if self.cycle_window is not None and self.transactions['time'].notna().any():
+            window = int(pd.Timedelta(self.cycle_window).value)
+            components = self._temporal_components(components)
+        # Large searches go to the process pool, if the process started one
+        pool, workers = _running_cycle_pool()
+        if pool is not None and sum(len(component[0]) for component in components) >= self.parallel_cycle_min_nodes:
+            cycles = self._find_money_loops_parallel(components, pool, workers, window)
+        else:
+            cycles = self._find_cycles(components, window)
+        for cycle, cycle_amounts in cycles:
+            # Time-respecting loops list their transfers from the first one on
+            self._record_cycle(cycle, cycle_amounts, ordered=window is not None)
 
-        amount_col = 'amount' if 'amount' in df.columns else (df.columns[2] if len(df.columns) > 2 else None)
+        return self._score_transactions(self.transactions)
 
-        scores = []
-        all_reasons = []
-        node_paths = []
-        
-        for _, row in df.iterrows():
-            sender = str(row[sender_col]).strip().lower()
-            receiver = str(row[receiver_col]).strip().lower()
-            amount = float(row[amount_col]) if amount_col and pd.notna(row[amount_col]) else 1.0
-
-            if pd.notna(sender) and pd.notna(receiver):
-                score, reasons = self._compute_anomaly_score(sender, receiver, amount)
-                # Pull raw cycle nodes for the WOW feature
-                nodes = self.edge_to_nodes_map.get((sender, receiver))
-                node_paths.append(nodes)
-            else:
-                score = 0.5 
-                reasons = ["Incomplete transaction data"]
-                node_paths.append(None)
-
-            scores.append(score)
-            all_reasons.append(reasons)
-                
-        return scores, all_reasons, node_paths
+    def _score_transactions(self, tx):
+        """
+        Vectorized _compute_anomaly_score over a transaction frame from _build_graph.
+        Community and cycle lookups are joined onto the rows instead of looped;
+        ping-pong transfers (see _ping_pong) and fan-in/fan-out mule patterns
+        (see _fan_patterns) add their own score and reasons.
+        Returns: (scores_list, reasons_list_of_lists, node_paths_list)
+        """
+        # Community-based anomaly: transactions between different communities are suspicious
+        sender_comm = tx['sender'].map(self.communities).fillna(-1)
+        receiver_comm = tx['receiver'].map(self.communities).fillna(-1)
+        cross = (sender_comm != receiver_comm).to_numpy()
+
+        # Cycle Detection Check: join each transaction to the cycle its edge belongs to
+        cycle_edges = pd.DataFrame(
+            [(u, v, nodes) for (u, v), nodes in self.edge_to_nodes_map.items()],
+            columns=['sender', 'receiver', 'node_path']
+        )
+        joined = tx[['sender', 'receiver']].merge(cycle_edges, on=['sender', 'receiver'], how='left')
+        in_cycle = joined['node_path'].notna().to_numpy()
+
+        ping_pong = self._ping_pong(tx)
+        fan_in, fan_out = self._fan_patterns(tx)
+
+        scores = np.minimum(0.3 * cross + 0.9 * in_cycle + 0.8 * ping_pong + 0.5 * (fan_in | fan_out), 1.0)
+
+        labels = ("Unrelated Network Transfer", "Circular Money Loop Detected", "Ping-Pong Transfer Detected",
+                  "High Fan-In (Mule Collection)", "High Fan-Out (Mule Distribution)")
+        flags = (cross, in_cycle, ping_pong, fan_in, fan_out)
+        reason_sets = [[label for bit, label in enumerate(labels) if combo >> bit & 1] for combo in range(1 << len(labels))]
+        combos = sum(flag.astype(int) << bit for bit, flag in enumerate(flags))
+        all_reasons = [list(reason_sets[c]) for c in combos]
+
+        # Pull raw cycle nodes for the WOW feature (the two accounts of a ping-pong)
+        node_paths = joined['node_path'].astype(object).where(in_cycle, None).tolist()
+        for i in np.flatnonzero(ping_pong & ~in_cycle).tolist():
+            node_paths[i] = [tx['sender'].iat[i], tx['receiver'].iat[i]]
+
+        return scores.tolist(), all_reasons, node_paths
+
+    def _ping_pong(self, tx):
+        """
+        Flag transfers that bounce straight back: a transfer in the opposite
+        direction between the same two accounts, within ping_pong_window and
+        ping_pong_tolerance of the amount, either before or after it.
+        Each transfer is matched to its nearest reverse transfer on each side
+        with merge_asof, hash-joined on the account pair, so the check costs
+        a sort rather than a cycle search.
+        Returns a boolean array over the rows of tx.
+        """
+        flagged = np.zeros(len(tx), dtype=bool)
+        if self.ping_pong_window is None:
+            return flagged
+        timed = tx[tx['time'].notna() & (tx['sender'] != '') & (tx['receiver'] != '') & (tx['sender'] != tx['receiver'])]
+        if timed.empty:
+            return flagged
+
+        transfers = pd.DataFrame({
+            'row': timed.index.to_numpy(),  # tx comes from _transaction_frame, indexed 0..n-1
+            'sender': timed['sender'].to_numpy(),
+            'receiver': timed['receiver'].to_numpy(),
+            'time': timed['time'].to_numpy('datetime64[ns]'),
+            'amount': timed['amount'].to_numpy()
+        }).sort_values('time', kind='stable')
+        # The same transfers seen from the other side: (receiver, sender) keys
+        reverse = transfers.rename(columns={'sender': 'receiver', 'receiver': 'sender', 'amount': 'reverse_amount'})
+        reverse = reverse[['time', 'sender', 'receiver', 'reverse_amount']]
+
+        for direction in ('backward', 'forward'):
+            matched = pd.merge_asof(transfers, reverse, on='time', by=['sender', 'receiver'], direction=direction,
+                                    tolerance=pd.Timedelta(self.ping_pong_window), allow_exact_matches=True)
+            amount, reverse_amount = matched['amount'].to_numpy(), matched['reverse_amount'].to_numpy()
+            bounced = ((amount > 0) & (reverse_amount > 0) &
+                       (np.abs(amount - reverse_amount) <= self.ping_pong_tolerance * np.maximum(amount, reverse_amount)))
+            flagged[matched['row'].to_numpy()[bounced]] = True
+        return flagged
+
+    def _fan_patterns(self, tx):
+        """
+        Flag mule-like transfers: the receiver took money from at least
+        fan_min_accounts distinct senders (fan-in), or the sender paid at
+        least that many distinct receivers (fan-out), within a sliding
+        fan_window around the transfer (see _fan_bursts).
+        Returns (fan_in, fan_out) boolean arrays over the rows of tx.
+        """
+        fan_in = np.zeros(len(tx), dtype=bool)
+        fan_out = np.zeros(len(tx), dtype=bool)
+        if self.fan_window is None:
+            return fan_in, fan_out
+        timed = tx[tx['time'].notna() & (tx['sender'] != '') & (tx['receiver'] != '')]
+        if timed.empty:
+            return fan_in, fan_out
+
+        senders = timed['sender'].to_numpy()
+        receivers = timed['receiver'].to_numpy()
+        times = timed['time'].to_numpy('datetime64[ns]').astype(np.int64)
+        window = int(pd.Timedelta(self.fan_window).value)
+        rows = timed.index.to_numpy()  # tx comes from _transaction_frame, indexed 0..n-1
+        fan_in[rows] = self._fan_bursts(receivers, senders, times, window)
+        fan_out[rows] = self._fan_bursts(senders, receivers, times, window)
+        return fan_in, fan_out
+
+    def _fan_bursts(self, accounts, counterparties, times, window):
+        """
+        Whether each transfer falls in a window-long span (times in ns) in
+        which its account dealt with fan_min_accounts or more distinct
+        counterparties. Only accounts with that many counterparties overall
+        are examined. For those, each counterparty's transfers are merged into
+        the periods [first, last + window] they keep it inside a trailing
+        window, so the distinct count at any time is the number of open
+        periods (two sorted searches); a transfer is flagged when the count
+        reaches the threshold within window after it.
+        """
+        flagged = np.zeros(len(accounts), dtype=bool)
+        pairs = pd.DataFrame({'account': accounts, 'counterparty': counterparties})
+        distinct = pairs.drop_duplicates().groupby('account', sort=False).size()
+        candidates = distinct.index[distinct >= self.fan_min_accounts]
+        if candidates.empty:
+            return flagged
+
+        # Row positions of each candidate account's transfers
+        candidate_rows = np.flatnonzero(pairs['account'].isin(candidates).to_numpy())
+        codes = pd.factorize(accounts[candidate_rows])[0]
+        by_account = np.argsort(codes, kind='stable')
+        bounds = np.flatnonzero(np.r_[True, np.diff(codes[by_account]) != 0, True])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            idx = candidate_rows[by_account[lo:hi]]
+            account_times = times[idx]
+            counterparty = pd.factorize(counterparties[idx])[0]
+            order = np.lexsort((account_times, counterparty))
+            by_pair, by_time = counterparty[order], account_times[order]
+            # A counterparty's period restarts after a gap longer than the window
+            opens = np.r_[True, (by_pair[1:] != by_pair[:-1]) | (np.diff(by_time) > window)]
+            closes = np.r_[opens[1:], True]
+            starts = np.sort(by_time[opens])
+            ends = np.sort(by_time[closes] + window)
+            # Distinct counterparties in the window ending at each transfer
+            counts = np.searchsorted(starts, account_times, 'right') - np.searchsorted(ends, account_times, 'left')
+            peaks = np.sort(account_times[counts >= self.fan_min_accounts])
+            if not len(peaks):
+                continue
+            following = np.searchsorted(peaks, account_times, 'left')
+            reached = following < len(peaks)
+            flagged[idx[reached]] = peaks[following[reached]] - account_times[reached] <= window
+        return flagged
+
+
+def start_cycle_pool(workers=None):
+    """
+    Start the process pool that detect_anomalies uses for large cycle
+    searches (GraphAnomalyDetector.cycle_workers processes, one per CPU by
+    default; none with fewer than two). Call it once at startup, from the
+    main thread. Workers are started with forkserver (spawn where that is
+    unavailable), never by forking a possibly multithreaded server, and the
+    pool is shut down at exit. Without a pool, searches run serially.
+    Returns the pool, or None.
+    """
+    global _cycle_pool, _cycle_pool_workers
+    workers = workers or GraphAnomalyDetector.cycle_workers or os.cpu_count() or 1
+    if workers < 2:
+        return None
+    with _cycle_pool_lock:
+        if _cycle_pool is None:
+            _cycle_pool = _new_cycle_pool(workers)
+            _cycle_pool_workers = workers
+            atexit.register(shutdown_cycle_pool)
+        return _cycle_pool
+
+
+def shutdown_cycle_pool():
+    """Stop the cycle search pool; later searches run serially."""
+    global _cycle_pool, _cycle_pool_workers
+    with _cycle_pool_lock:
+        pool, _cycle_pool, _cycle_pool_workers = _cycle_pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _new_cycle_pool(workers):
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+def _running_cycle_pool():
+    """(pool, workers) started by start_cycle_pool, or (None, 0)."""
+    with _cycle_pool_lock:
+        return _cycle_pool, _cycle_pool_workers or 0
+
+
+def _restart_cycle_pool(broken):
+    """Replace a broken pool by a new one of the same size (workers never fork the server)."""
+    global _cycle_pool
+    with _cycle_pool_lock:
+        if _cycle_pool is broken:
+            _cycle_pool = _new_cycle_pool(_cycle_pool_workers)
+    broken.shutdown(wait=False)
+
+
+def _search_cycle_tasks(task, path, max_length, window=None, tolerance=0.05):
+    """
+    Process-pool worker for the cycle search: run the bounded search over one
+    task from GraphAnomalyDetector._cycle_tasks and return (accounts,
+    edge_amounts) for the cycles that qualify as money loops, so only those
+    travel back to the parent process. The components are read from the
+    pickle at path the first time this worker sees it.
+    """
+    global _worker_components
+    if _worker_components[0] != path:
+        with open(path, 'rb') as f:
+            _worker_components = (path, pickle.load(f))
+    components = _worker_components[1]
+
+    found = []
+    for index, start, stop in task:
+        names, successors, predecessors, edges = components[index]
+        for cycle, cycle_amounts in GraphAnomalyDetector._component_cycles(successors, predecessors, edges, max_length,
+                                                                           window, range(start, stop), tolerance):
+            if GraphAnomalyDetector._is_money_loop(cycle_amounts, tolerance, ordered=window is not None):
+                found.append(([names[i] for i in cycle], cycle_amounts))
+    return found
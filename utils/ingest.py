@@ -0,0 +1,313 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.preprocess import Preprocessor
+
+logger = logging.getLogger(__name__)
+
+class StreamingIngestor:
+    """
+    Streaming ingestion for uploaded transaction files.
+    Uploads are spooled straight to disk and read back in bounded-size chunks,
+    each cleaned by the Preprocessor on its own, so the raw text never has to
+    sit in memory as one string. CSV, Parquet and Arrow IPC files are accepted.
+    Once a file has been cleaned, the typed frame is spilled as Parquet so later
+    analyses, reports and profiles reload columns without parsing anything,
+    and the spooled upload itself is deleted.
+    """
+
+    # File extension -> input format
+    formats = {
+        '.csv': 'csv',
+        '.parquet': 'parquet',
+        '.arrow': 'arrow',
+        '.feather': 'arrow',
+        '.ipc': 'arrow'
+    }
+
+    def __init__(self, upload_dir=None, chunk_rows=50000):
+        self.upload_dir = upload_dir or os.path.join(tempfile.gettempdir(), 'vigilo_uploads')
+        self.spill_dir = os.path.join(self.upload_dir, 'spill')
+        self.chunk_rows = chunk_rows
+
+    def is_supported(self, filename):
+        return os.path.splitext(filename.lower())[1] in self.formats
+
+    def spool(self, file_storage, file_id):
+        """
+        Write an uploaded file to the spool directory and return its path.
+        """
+        extension = os.path.splitext(file_storage.filename.lower())[1]
+        if extension not in self.formats:
+            raise ValueError(f"Unsupported file type: {extension or file_storage.filename}")
+
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, f"{file_id}{extension}")
+        # FileStorage.save copies the request stream in fixed-size blocks
+        file_storage.save(path)
+        return path
+
+    def iter_chunks(self, path):
+        """
+        Yield the raw file as DataFrames of at most chunk_rows rows.
+        CSV values are kept as text exactly as uploaded (only empty cells
+        become missing values); columnar files keep their own column types.
+        A file that cannot be read in its format raises ValueError, as a
+        malformed CSV does.
+        """
+        file_format = self.formats.get(os.path.splitext(path.lower())[1], 'csv')
+        if file_format in ('parquet', 'arrow'):
+            try:
+                if file_format == 'parquet':
+                    for batch in pq.ParquetFile(path).iter_batches(batch_size=self.chunk_rows):
+                        yield batch.to_pandas()
+                else:
+                    yield from self._iter_arrow_chunks(path)
+            except pa.ArrowInvalid as e:
+                name = 'Parquet' if file_format == 'parquet' else 'Arrow IPC'
+                raise ValueError(f"Invalid {name} file: {e}") from e
+        else:
+            try:
+                reader = pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''],
+                                     chunksize=self.chunk_rows, encoding='utf-8')
+                for chunk in reader:
+                    yield chunk
+            except pd.errors.EmptyDataError:
+                return
+
+    def _iter_arrow_chunks(self, path):
+        """
+        Read an Arrow IPC file (random-access or stream layout, i.e. Feather V2)
+        in chunks. Anything else, Feather V1 included, fails the stream read
+        with ArrowInvalid.
+        """
+        with pa.memory_map(path, 'r') as source:
+            try:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                batches = iter(pa.ipc.open_stream(source))
+
+            pending, pending_rows = [], 0
+            for batch in batches:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows >= self.chunk_rows:
+                    yield pa.Table.from_batches(pending).to_pandas()
+                    pending, pending_rows = [], 0
+            if pending:
+                yield pa.Table.from_batches(pending).to_pandas()
+
+    def load(self, path, keep_raw=False):
+        """
+        Clean the file chunk by chunk and return the combined cleaned frame.
+        With keep_raw=True, also return the uploaded values (same index).
+        """
+        preprocessor = Preprocessor()
+        raw_chunks, clean_chunks = [], []
+        offset = 0
+        for chunk in self.iter_chunks(path):
+            if chunk.empty:
+                continue
+            # Keep one running index across chunks, as read_csv does for CSV
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            if keep_raw:
+                raw_chunks.append(chunk)
+            clean_chunks.append(preprocessor.clean_data(chunk.copy() if keep_raw else chunk))
+
+        if not clean_chunks:
+            empty = pd.DataFrame()
+            return (empty, empty) if keep_raw else empty
+
+        df = pd.concat(clean_chunks) if len(clean_chunks) > 1 else clean_chunks[0]
+        if not keep_raw:
+            return df
+        raw_df = pd.concat(raw_chunks) if len(raw_chunks) > 1 else raw_chunks[0]
+        return raw_df, df
+
+    def load_upload(self, file_id, path, keep_raw=False):
+        """
+        Load an upload, preferring its Parquet spill over re-reading the file.
+        The first load of a file writes the spill and, once it is complete,
+        deletes the spooled file; without a spill the file is kept for the
+        next load.
+        """
+        spilled = self.load_spilled(file_id, keep_raw)
+        if spilled is not None:
+            return spilled
+
+        raw_df, df = self.load(path, keep_raw=True)
+        if not df.empty and self.spill(file_id, df, raw_df):
+            self.remove(path)
+        return (raw_df, df) if keep_raw else df
+
+    @staticmethod
+    def remove(path):
+        """Delete a file if it is still there."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete {path}: {e}")
+
+    def _spill_paths(self, file_id):
+        return (os.path.join(self.spill_dir, f"{file_id}.clean.parquet"),
+                os.path.join(self.spill_dir, f"{file_id}.raw.parquet"))
+
+    def spill(self, file_id, df, raw_df=None):
+        """
+        Write the cleaned frame (and optionally the raw values) as Parquet.
+        Spilling is an optimisation only: failures are logged and ignored.
+        Returns whether the spill was written.
+        """
+        clean_path, raw_path = self._spill_paths(file_id)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            if raw_df is not None:
+                raw_df.to_parquet(raw_path)
+            # Written last: its presence marks a complete spill
+            df.to_parquet(clean_path)
+            return True
+        except (pa.ArrowException, ValueError, TypeError, OSError) as e:
+            logger.warning(f"Could not spill {file_id} as Parquet: {e}")
+            for path in (clean_path, raw_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+
+    def discard_spill(self, file_id):
+        """Delete an upload's Parquet spill."""
+        for path in self._spill_paths(file_id):
+            self.remove(path)
+
+    def load_spilled(self, file_id, keep_raw=False):
+        """Reload a spilled upload, or return None if there is no spill."""
+        clean_path, raw_path = self._spill_paths(file_id)
+        if not os.path.exists(clean_path) or (keep_raw and not os.path.exists(raw_path)):
+            return None
+        df = pd.read_parquet(clean_path)
+        if not keep_raw:
+            return df
+        return pd.read_parquet(raw_path), df
+
+
+class UploadStore:
+    """
+    The uploads the app knows about: file_id -> spooled file and the cached
+    analysis frame. Uploads unused for ttl seconds expire, and past
+    max_uploads the least recently used ones are evicted; a dropped upload's
+    spooled file and Parquet spill are deleted with it. Every new upload also
+    sweeps the spool and spill directories for files older than ttl that no
+    upload owns (left behind by an earlier run), so neither memory nor disk
+    grows with the number of uploads.
+    """
+
+    max_uploads = 64
+    # Seconds an upload may stay unused before it is dropped
+    ttl = 3600
+
+    def __init__(self, ingestor, max_uploads=None, ttl=None):
+        self.ingestor = ingestor
+        if max_uploads is not None:
+            self.max_uploads = max_uploads
+        if ttl is not None:
+            self.ttl = ttl
+        # file_id -> {'path', 'frame', 'last_used'}, least recently used first
+        self._uploads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._uploads)
+
+    def __contains__(self, file_id):
+        return self._touch(file_id) is not None
+
+    def add(self, file_id, path):
+        """Register a spooled upload, dropping expired and surplus ones first."""
+        with self._lock:
+            dropped = self._evict(room=1)
+            self._uploads[file_id] = {'file_id': file_id, 'path': path, 'frame': None,
+                                      'last_used': time.monotonic()}
+            live = set(self._uploads)
+        for entry in dropped:
+            self._delete_files(entry)
+        self._sweep_directory(self.ingestor.upload_dir, live)
+        self._sweep_directory(self.ingestor.spill_dir, live)
+
+    def path(self, file_id):
+        """The upload's spooled file (possibly deleted after its spill), or None if unknown."""
+        entry = self._touch(file_id)
+        return entry['path'] if entry else None
+
+    def cached(self, file_id):
+        """The upload's cached analysis frame, or None."""
+        entry = self._touch(file_id)
+        return entry['frame'] if entry else None
+
+    def cache(self, file_id, df):
+        """Keep the analysis frame of a known upload."""
+        entry = self._touch(file_id)
+        if entry is not None:
+            entry['frame'] = df
+
+    def discard(self, file_id):
+        """Forget an upload and delete its files."""
+        with self._lock:
+            entry = self._uploads.pop(file_id, None)
+        if entry is not None:
+            self._delete_files(entry)
+
+    def _touch(self, file_id):
+        with self._lock:
+            dropped = self._evict()
+            entry = self._uploads.get(file_id)
+            if entry is not None:
+                self._uploads.move_to_end(file_id)
+                entry['last_used'] = time.monotonic()
+        for dropped_entry in dropped:
+            self._delete_files(dropped_entry)
+        return entry
+
+    def _evict(self, room=0):
+        """Pop expired uploads, then the least recently used ones over max_uploads - room (store lock held)."""
+        now = time.monotonic()
+        over = len(self._uploads) - self.max_uploads + room
+        dropped = []
+        for file_id, entry in list(self._uploads.items()):
+            if over <= 0 and now - entry['last_used'] <= self.ttl:
+                # Everything after this one was used more recently
+                break
+            dropped.append(self._uploads.pop(file_id))
+            over -= 1
+        return dropped
+
+    def _delete_files(self, entry):
+        self.ingestor.remove(entry['path'])
+        self.ingestor.discard_spill(entry['file_id'])
+
+    def _sweep_directory(self, directory, live):
+        """Delete files older than ttl in directory whose name starts with no known file_id."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stale = os.path.isfile(path) and os.path.getmtime(path) < cutoff
+            except OSError:
+                continue
+            # Spools are <file_id>.<ext>, spills <file_id>.clean/.raw.parquet
+            if stale and name.split('.', 1)[0] not in live:
+                self.ingestor.remove(path)
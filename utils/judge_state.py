@@ -0,0 +1,286 @@
+import copy
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from utils.ddie import DDIE, TransactionRegistry
+from utils.graph_anomaly import GraphAnomalyDetector
+
+
+class JudgeState:
+    """
+    Incremental state behind Judge Mode.
+    A judged transaction is checked against the state it needs instead of
+    the whole history being re-cleaned and re-scored on every call:
+      registry  transaction IDs seen so far (replay detection)
+      graph     persistent transaction graph, updated one edge at a time
+      recent    per-user ring buffer of that user's latest transactions, all
+                the burst and location-jump rules look at
+      running aggregates (amount mean/std/min/max, time span, per-user
+                counts) for the UAIC user-frequency feature and global stats
+      history   the latest judged transactions, for /api/judge_history
+      stage_skips  consecutive latency-budget skips of each optional stage
+                (see utils.latency.LatencyBudget)
+    Every structure is either bounded or grows with distinct IDs/users only,
+    so the cost of a call does not depend on how long the session has run.
+    """
+
+    # Transactions kept per user for the history rules (burst: 2 seconds, location jump: 10 minutes)
+    user_buffer_size = 64
+    # Transactions returned by /api/judge_history
+    history_size = 1000
+
+    def __init__(self):
+        self.registry = TransactionRegistry()
+        self.graph = GraphAnomalyDetector()
+        self.recent = {}
+        self.history = deque(maxlen=self.history_size)
+        self.stage_skips = {}
+        self.user_counts = Counter()
+        self.most_active_user = None
+        # Running amount aggregates (Welford's algorithm for the variance)
+        self.count = 0
+        self.amount_mean = 0.0
+        self._amount_m2 = 0.0
+        self.amount_min = None
+        self.amount_max = None
+        self.first_time = None
+        self.last_time = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """Start from a cleaned transaction history (e.g. the sample data)."""
+        state = cls()
+        if df.empty:
+            return state
+        state.registry.register(df['transaction_id'])
+        state.graph.detect_anomalies(df)
+        for record in df.to_dict('records'):
+            state.record(record)
+        return state
+
+    def check_rules(self, row):
+        """
+        DDIE rule score and reasons for one cleaned transaction (a one-row
+        frame). Replays are looked up in the registry (which then holds the
+        ID); the other rules run on the row plus its user's recent
+        transactions, the only rows the burst and location rules compare it
+        with. Returns (rule_score, reasons).
+        """
+        scores, reasons = self.check_rules_batch(row)
+        return scores[0], reasons[0]
+
+    def check_rules_batch(self, rows):
+        """
+        check_rules for a frame of cleaned transactions in one vectorized
+        pass: the rules run once over the batch plus the recent transactions
+        of every user in it, so rows of one batch are also checked against
+        each other (both transactions of a burst are flagged, as in a file
+        analysis). Returns (rule_scores array, reasons lists) in row order.
+        """
+        replay = DDIE(registry=self.registry).apply_rules(rows, rules=['duplicate_detection'])
+
+        recent = [record for user_id in rows['user_id'].unique() for record in self.recent.get(user_id, ())]
+        frame = pd.concat([pd.DataFrame(recent), rows], ignore_index=True) if recent else rows
+        ddie = DDIE()
+        history_rules = [name for name in ddie.vector_rules if name != 'duplicate_detection']
+        result = ddie.apply_rules(frame, rules=history_rules).iloc[len(recent):]
+
+        scores = np.minimum(replay['rule_score'].to_numpy() + result['rule_score'].to_numpy(), 1.0)
+        reasons = [r + h for r, h in zip(replay['reasons'], result['reasons'])]
+        return scores, reasons
+
+    def record(self, record, is_anomalous=None, final_score=None):
+        """Add a cleaned transaction (a dict) and its verdict to the state."""
+        if is_anomalous is not None:
+            record = {**record, 'is_anomalous': is_anomalous, 'final_score': final_score}
+
+        user_id = record.get('user_id')
+        recent = self.recent.get(user_id)
+        if recent is None:
+            recent = self.recent[user_id] = deque(maxlen=self.user_buffer_size)
+        recent.append(record)
+        self.history.append(record)
+
+        self.user_counts[user_id] += 1
+        if self.most_active_user is None or self.user_counts[user_id] > self.user_counts[self.most_active_user]:
+            self.most_active_user = user_id
+
+        amount = pd.to_numeric(record.get('amount'), errors='coerce')
+        if pd.notna(amount):
+            amount = float(amount)
+            self.count += 1
+            delta = amount - self.amount_mean
+            self.amount_mean += delta / self.count
+            self._amount_m2 += delta * (amount - self.amount_mean)
+            self.amount_min = amount if self.amount_min is None else min(self.amount_min, amount)
+            self.amount_max = amount if self.amount_max is None else max(self.amount_max, amount)
+
+        timestamp = record.get('timestamp')
+        if isinstance(timestamp, pd.Timestamp) and pd.notna(timestamp):
+            self.first_time = timestamp if self.first_time is None else min(self.first_time, timestamp)
+            self.last_time = timestamp if self.last_time is None else max(self.last_time, timestamp)
+
+    def user_frequency(self, user_id):
+        """{user_id: transactions so far}, the UAIC precomputed_freqs for one row."""
+        return {user_id: self.user_counts[user_id]}
+
+    def user_frequencies(self, user_ids):
+        """
+        Transactions of each row's user before that row, counting earlier rows
+        of the same batch: user_frequency for every row judged in order.
+        """
+        user_ids = pd.Series(user_ids).reset_index(drop=True)
+        before = user_ids.map(lambda user_id: self.user_counts[user_id]).to_numpy(dtype=float)
+        return before + user_ids.groupby(user_ids, sort=False, dropna=False).cumcount().to_numpy()
+
+    def global_stats(self):
+        """
+        The SSG.compute_global_stats signatures that follow from running
+        aggregates (quantile-based ones need the full history and are left out).
+        """
+        stats = {}
+        if self.count:
+            stats['mean_amount'] = self.amount_mean
+            stats['std_amount'] = math.sqrt(self._amount_m2 / (self.count - 1)) if self.count > 1 else 0.0
+            stats['min_amount'] = self.amount_min
+            stats['max_amount'] = self.amount_max
+
+        if self.first_time is not None:
+            time_range_hours = (self.last_time - self.first_time).total_seconds() / 3600
+            if time_range_hours > 0:
+                stats['transaction_velocity'] = sum(self.user_counts.values()) / time_range_hours
+
+        if self.user_counts:
+            stats['unique_users'] = len(self.user_counts)
+            stats['avg_transactions_per_user'] = sum(self.user_counts.values()) / len(self.user_counts)
+            stats['max_transactions_per_user'] = self.user_counts[self.most_active_user]
+            stats['most_active_user_id'] = str(self.most_active_user)
+        return stats
+
+
+class JudgeSession:
+    """One analyst's Judge Mode state, the lock serialising calls on it and its last use."""
+
+    def __init__(self, state):
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class JudgeSessionStore:
+    """
+    Judge Mode states keyed by session (or tenant) ID.
+    Each session is judged under its own lock, so concurrent calls in one
+    session are applied one after another and calls in different sessions
+    never wait for each other; the store lock is only held to look a session
+    up. A new session starts from a copy of the base state (the sample
+    history), which itself is never modified. Sessions idle for longer than
+    ttl seconds are dropped, and past max_sessions the least recently used
+    idle ones are evicted, so memory stays bounded with many analysts.
+    """
+
+    max_sessions = 256
+    # Seconds a session may stay idle before it is dropped
+    ttl = 1800
+
+    def __init__(self, base=None, max_sessions=None, ttl=None):
+        self.base = base
+        if max_sessions is not None:
+            self.max_sessions = max_sessions
+        if ttl is not None:
+            self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def new_state(self):
+        return copy.deepcopy(self.base) if self.base is not None else JudgeState()
+
+    def _get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_used = time.monotonic()
+                self._evict(keep=session_id)
+                return session
+
+        # Copied outside the store lock; if another call created the session
+        # meanwhile, its copy wins
+        session = JudgeSession(self.new_state())
+        with self._lock:
+            if session_id not in self._sessions:
+                # Only a new session needs room
+                self._evict(room=1)
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def _evict(self, room=0, keep=None):
+        """
+        Drop expired sessions, then the least recently used ones until room
+        more fit under max_sessions (store lock held). The session keep,
+        being looked up, is never dropped.
+        """
+        now = time.monotonic()
+        over = len(self._sessions) - self.max_sessions + room
+        for session_id, session in list(self._sessions.items()):
+            # Sessions being judged right now are never dropped
+            if session_id == keep or session.lock.locked():
+                continue
+            if over <= 0 and now - session.last_used <= self.ttl:
+                # Everything after this one was used more recently
+                break
+            del self._sessions[session_id]
+            over -= 1
+
+    def _acquire(self, session_id):
+        """
+        Look a session up and take its lock. Eviction may drop the session
+        between the lookup and the lock, so its presence is re-checked under
+        the store lock once held; a locked session is never evicted after that.
+        """
+        while True:
+            session = self._get(session_id)
+            session.lock.acquire()
+            with self._lock:
+                if self._sessions.get(session_id) is session:
+                    session.last_used = time.monotonic()
+                    return session
+            session.lock.release()
+
+    @contextmanager
+    def session(self, session_id):
+        """Hold the session's lock and yield its JudgeState."""
+        session = self._acquire(session_id)
+        try:
+            yield session.state
+            session.last_used = time.monotonic()
+        finally:
+            session.lock.release()
+
+    def reset(self, session_id):
+        """Replace a session's state with an empty one."""
+        session = self._acquire(session_id)
+        try:
+            session.state = JudgeState()
+        finally:
+            session.lock.release()
+
+    def history(self, session_id):
+        """The session's judged transactions (empty for unknown sessions, which are not created)."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return [] if self.base is None else list(self.base.history)
+        with session.lock:
+            return list(session.state.history)
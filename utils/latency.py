@@ -0,0 +1,103 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageCosts:
+    """
+    Typical duration of each optional Judge Mode stage, a moving average of
+    its past durations. One instance is shared by all requests of the app;
+    how many times in a row a stage was skipped is counted per session (in
+    a dict the caller passes, e.g. JudgeState.stage_skips), so one session's
+    skips never force a stage in another. Every read-modify-write, of the
+    costs or of a session's counts, happens under its lock, so concurrent
+    requests never lose updates.
+    """
+
+    # Weight of the latest duration in the moving averages
+    smoothing = 0.2
+    # A stage is never skipped more than this many times in a row in one session
+    max_skips = 100
+
+    def __init__(self, smoothing=None, max_skips=None):
+        if smoothing is not None:
+            self.smoothing = smoothing
+        if max_skips is not None:
+            self.max_skips = max_skips
+        # Stage name -> typical duration in seconds
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def cost(self, stage):
+        """Typical duration of stage in seconds (0 before it first ran)."""
+        with self._lock:
+            return self._costs.get(stage, 0.0)
+
+    def claim(self, stage, remaining, skips, force=False):
+        """
+        Decide whether stage runs with remaining seconds left, counting a skip
+        in the session's skips dict if not. A stage that does not fit still
+        runs when forced or after max_skips skips in a row.
+        Returns (run, over_budget).
+        """
+        with self._lock:
+            fits = remaining > self._costs.get(stage, 0.0)
+            if fits or force or skips.get(stage, 0) >= self.max_skips:
+                skips[stage] = 0
+                return True, not fits
+            skips[stage] = skips.get(stage, 0) + 1
+            return False, False
+
+    def record(self, stage, elapsed):
+        """Fold one run's duration (seconds) into the stage's typical cost."""
+        with self._lock:
+            cost = self._costs.get(stage)
+            self._costs[stage] = elapsed if cost is None else cost + self.smoothing * (elapsed - cost)
+
+
+class LatencyBudget:
+    """
+    Time budget of one Judge Mode request (None = unbounded).
+    Optional stages run in priority order while the time left covers their
+    typical cost (from the app's shared StageCosts); the others are skipped
+    and listed in skipped. skips holds the session's consecutive skips of
+    each stage (set it once the session is known): a stage is never skipped
+    more than StageCosts.max_skips times in a row in a session, so a cost
+    estimate inflated by one slow run gets corrected. Stages that ran
+    although they did not fit (forced, or skipped too often) are listed in
+    over_budget.
+    """
+
+    def __init__(self, costs, budget_ms=None, skips=None):
+        self.costs = costs
+        self.start = time.perf_counter()
+        self.budget = None if budget_ms is None else budget_ms / 1000
+        self.skips = skips if skips is not None else {}
+        self.skipped = []
+        self.over_budget = []
+
+    def remaining(self):
+        """Seconds left (infinite without a budget)."""
+        if self.budget is None:
+            return math.inf
+        return self.budget - (time.perf_counter() - self.start)
+
+    def allows(self, stage, force=False):
+        """
+        Whether stage should run now; records it as skipped if not. force=True
+        runs it regardless (e.g. work that can be deferred no longer).
+        """
+        run, over_budget = self.costs.claim(stage, self.remaining(), self.skips, force)
+        if not run:
+            self.skipped.append(stage)
+        elif over_budget:
+            self.over_budget.append(stage)
+        return run
+
+    @contextmanager
+    def timed(self, stage):
+        """Run a stage and fold its duration into its typical cost."""
+        started = time.perf_counter()
+        yield
+        self.costs.record(stage, time.perf_counter() - started)
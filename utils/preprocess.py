@@ -1,11 +1,23 @@
+import warnings
+from collections import Counter
+
 import pandas as pd
 from dateutil import parser
+from pandas.tseries.api import guess_datetime_format
 
 class Preprocessor:
     """
     Data preprocessing utilities for transaction data.
     """
 
+    # Dominant timestamp format per header signature. Shared by all instances so
+    # repeat uploads from the same source skip format detection.
+    _format_cache = {}
+    format_cache_size = 256
+    format_sample_size = 200
+    # Share of values the dominant format must parse for the fast path to be used
+    min_format_coverage = 0.5
+
     def __init__(self):
         self.required_columns = ['transaction_id', 'user_id', 'amount', 'timestamp', 'location', 'recipient_id']
         self.aliases = {
@@ -43,6 +55,9 @@ class Preprocessor:
         """
         Clean and preprocess the dataframe.
         """
+        # Header as uploaded, before alias mapping, identifies the source
+        signature = tuple(str(c) for c in df.columns)
+
         # Map aliases first
         df = self._map_columns(df)
 
@@ -58,9 +73,19 @@ class Preprocessor:
         if 'amount' in df.columns:
             df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
 
-        # Parse timestamps
+        # Parse timestamps once into the canonical datetime64[ns] column every
+        # engine reads directly. Values that could not be parsed are flagged in
+        # 'timestamp_invalid' before being filled, so "Broken Time" still fires.
         if 'timestamp' in df.columns:
-            df['timestamp'] = df['timestamp'].apply(self._parse_timestamp)
+            raw = df['timestamp']
+            parsed = self._parse_timestamps(raw, signature)
+            blank = raw.isna() | raw.map(lambda v: isinstance(v, str) and not v.strip())
+            invalid = parsed.isna() & ~blank
+            if 'timestamp_invalid' in df.columns:
+                # Re-cleaning an already cleaned frame keeps its earlier flags
+                invalid |= df['timestamp_invalid'].eq(True)
+            df['timestamp'] = parsed
+            df['timestamp_invalid'] = invalid.astype(bool)
 
         # Fill missing values appropriately
         df = df.fillna({
@@ -73,13 +98,125 @@ class Preprocessor:
 
         return df
 
+    def _parse_timestamps(self, values, signature=None):
+        """
+        Parse a timestamp column to naive datetime64[ns], NaT where unreadable.
+        Values in the column's dominant format are converted in one vectorized
+        call; only the rest go through dateutil.
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return as_datetime64(values)
+
+        fmt = self._format_cache.get(signature) if signature is not None else None
+        parsed, matched = self._parse_with_format(values, fmt)
+        if fmt is None or matched.mean() < self.min_format_coverage:
+            # Unknown source, or the cached format no longer fits it
+            fmt = self._detect_format(values)
+            parsed, matched = self._parse_with_format(values, fmt)
+            if signature is not None:
+                self._remember_format(signature, fmt)
+
+        if not matched.all():
+            parsed = parsed.astype(object)
+            parsed[~matched] = values[~matched].map(self._parse_timestamp)
+        return as_datetime64(parsed)
+
+    def _parse_with_format(self, values, fmt):
+        """Vectorized parse with an explicit format; returns (parsed, matched mask)."""
+        if fmt is None:
+            return pd.Series(pd.NaT, index=values.index), pd.Series(False, index=values.index)
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce')
+        return parsed, parsed.notna()
+
+    def _detect_format(self, values):
+        """
+        Guess the dominant timestamp format from a sample of the column.
+        Returns None when no single format covers enough of the sample.
+        """
+        sample = values.dropna()
+        sample = sample[sample.map(lambda v: isinstance(v, str))]
+        if sample.empty:
+            return None
+        if len(sample) > self.format_sample_size:
+            sample = sample.sample(self.format_sample_size, random_state=0)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            guesses = Counter(guess_datetime_format(v.strip()) for v in sample)
+        guesses.pop(None, None)
+
+        for fmt, _ in guesses.most_common():
+            # Two-digit years resolve to a different century than dateutil does
+            if '%y' in fmt:
+                continue
+            _, matched = self._parse_with_format(sample, fmt)
+            if matched.mean() >= self.min_format_coverage:
+                return fmt
+        return None
+
+    def _remember_format(self, signature, fmt):
+        cache = Preprocessor._format_cache
+        cache.pop(signature, None)
+        if len(cache) >= self.format_cache_size:
+            cache.pop(next(iter(cache)))
+        cache[signature] = fmt
+
     def _parse_timestamp(self, ts):
         """
-        Parse timestamp with error handling.
+        Parse timestamp with error handling. Returns NaT when unreadable.
         """
         if pd.isna(ts):
-            return pd.Timestamp.now()
+            return pd.NaT
         try:
             return parser.parse(str(ts))
         except:
-            return pd.Timestamp.now()
+            return pd.NaT
+
+
+def as_datetime64(values):
+    """
+    Return a timestamp column as timezone-naive datetime64[ns].
+    The column produced by Preprocessor.clean_data is returned as is, so
+    engines can call this instead of re-parsing. Anything else follows the
+    per-value pd.to_datetime rules: unreadable values become NaT, values
+    beyond the ns range are clipped to it and timezone-aware values keep
+    their wall-clock time.
+    """
+    if values.dtype == 'datetime64[ns]':
+        return values
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        parsed = values
+    else:
+        try:
+            parsed = pd.to_datetime(values, errors='coerce')
+        except (TypeError, ValueError):
+            parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    if getattr(parsed.dt, 'tz', None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+
+    # Mixed formats or mixed timezones make the column-wide parse give up on
+    # some rows; retry those one by one.
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed = parsed.astype(object)
+        parsed[retry] = values[retry].map(_as_naive_timestamp)
+        parsed = pd.to_datetime(parsed)
+
+    # Readable dates beyond the datetime64[ns] range (e.g. year 2999) are
+    # clipped to its ends rather than dropped, so they still read as future
+    # (or past) dates instead of unreadable ones
+    parsed = parsed.clip(lower=pd.Timestamp.min.ceil('s'), upper=pd.Timestamp.max.floor('s'))
+    return parsed.dt.as_unit('ns')
+
+
+def _as_naive_timestamp(value):
+    try:
+        ts = pd.to_datetime(value, errors='coerce')
+    except Exception:
+        return pd.NaT
+    if pd.isna(ts):
+        return pd.NaT
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts
@@ -0,0 +1,141 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def label_propagation(matrix, max_iter=30, seed=0):
+    """
+    Weighted label propagation on a symmetric CSR weight matrix; returns one
+    community label (0..k-1) per node. Each round a random half of the nodes
+    takes the label with the largest total edge weight among its neighbours
+    (keeping its own label on ties), computed for all of them at once. Half
+    updates stop synchronous label swaps from oscillating.
+    """
+    n = matrix.shape[0]
+    labels = np.arange(n)
+    coo = matrix.tocoo()
+    rows, cols, weights = coo.row.astype(np.int64), coo.col, coo.data
+    rng = np.random.default_rng(seed)
+
+    quiet_rounds = 0
+    for _ in range(max_iter):
+        if len(rows) == 0:
+            break
+        # Total weight per (node, neighbour label), sorted by node then label
+        keys, inverse = np.unique(rows * n + labels[cols], return_inverse=True)
+        totals = np.bincount(inverse, weights=weights)
+        nodes, candidates = keys // n, keys % n
+
+        starts = np.flatnonzero(np.r_[True, nodes[1:] != nodes[:-1]])
+        segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(nodes)]))
+        heaviest = totals >= np.maximum.reduceat(totals, starts)[segment]
+
+        # Heaviest label, the node's own label on ties, else the smallest tied label
+        keeps_own = np.logical_or.reduceat(heaviest & (candidates == labels[nodes]), starts)
+        tied = np.flatnonzero(heaviest)
+        smallest = tied[np.r_[True, segment[tied][1:] != segment[tied][:-1]]]
+        segment_nodes = nodes[starts]
+        best = labels.copy()
+        best[segment_nodes] = np.where(keeps_own, labels[segment_nodes], candidates[smallest])
+
+        update = rng.random(n) < 0.5
+        changed = update & (best != labels)
+        labels = np.where(update, best, labels)
+
+        quiet_rounds = quiet_rounds + 1 if not changed.any() else 0
+        if quiet_rounds >= 2:
+            break
+
+    return np.unique(labels, return_inverse=True)[1]
+
+
+class SparseTransactionGraph:
+    """
+    Directed transaction graph stored as a SciPy CSR adjacency matrix.
+    Accounts are integer-coded (accounts[i] is the name of node i). Entry
+    [i, j] of the adjacency matrix is the 1-based id of edge i -> j, so
+    zero-weight edges are still edges; weights[id - 1] and amounts[id - 1]
+    hold its data. Memory is a few arrays per edge instead of a Python dict
+    per node, and degree, SCC and community input are matrix operations.
+    """
+
+    def __init__(self, senders, receivers, weights, amounts):
+        codes, self.accounts = pd.factorize(np.concatenate([np.asarray(senders, dtype=object),
+                                                            np.asarray(receivers, dtype=object)]))
+        self.accounts = np.asarray(self.accounts, dtype=object)
+        n_edges = len(senders)
+        rows, cols = codes[:n_edges], codes[n_edges:]
+        shape = (len(self.accounts), len(self.accounts))
+
+        self.weights = np.asarray(weights, dtype=float)
+        self.amounts = np.asarray(amounts, dtype=float)
+        # Edge lists are already one row per (sender, receiver), so no ids are summed
+        edge_ids = np.arange(1, n_edges + 1, dtype=np.int64)
+        self.adjacency = sparse.csr_matrix((edge_ids, (rows, cols)), shape=shape)
+        self.adjacency.sort_indices()
+
+    def number_of_nodes(self):
+        return self.adjacency.shape[0]
+
+    def number_of_edges(self):
+        return self.adjacency.nnz
+
+    def out_degree(self):
+        return np.diff(self.adjacency.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.adjacency.indices, minlength=self.number_of_nodes())
+
+    def degree(self):
+        return self.out_degree() + self.in_degree()
+
+    def weight_matrix(self):
+        """CSR matrix of edge weights (same structure as the adjacency matrix)."""
+        weighted = self.adjacency.astype(float)
+        weighted.data = self.weights[self.adjacency.data - 1]
+        return weighted
+
+    def undirected(self):
+        """
+        Symmetric weight matrix for community detection; transfers in both
+        directions between two accounts add up to one undirected weight.
+        """
+        weighted = self.weight_matrix()
+        return (weighted + weighted.T).tocsr()
+
+    def strongly_connected_components(self, min_size=2):
+        """Yield the node codes of each strongly connected component of at least min_size accounts."""
+        if self.number_of_nodes() == 0:
+            return
+        _, labels = csgraph.connected_components(self.adjacency, directed=True, connection='strong')
+        sizes = np.bincount(labels)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        for label in np.flatnonzero(sizes >= min_size):
+            yield order[bounds[label]:bounds[label + 1]]
+
+    def component_adjacency(self, nodes):
+        """
+        Successor and predecessor lists (positions within nodes) plus the edge
+        amounts of the subgraph induced by nodes.
+        """
+        sub = self.adjacency[nodes][:, nodes].tocsr()
+        sub.sort_indices()
+        transposed = sub.T.tocsr()
+        successors = [sub.indices[sub.indptr[i]:sub.indptr[i + 1]].tolist() for i in range(len(nodes))]
+        predecessors = [transposed.indices[transposed.indptr[i]:transposed.indptr[i + 1]].tolist()
+                        for i in range(len(nodes))]
+        coo = sub.tocoo()
+        amounts = dict(zip(zip(coo.row.tolist(), coo.col.tolist()), self.amounts[coo.data - 1].tolist()))
+        return successors, predecessors, amounts
+
+    def to_networkx(self):
+        """DiGraph with account-name nodes and 'weight' edges, for measures not implemented here."""
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.accounts)
+        coo = self.adjacency.tocoo()
+        graph.add_weighted_edges_from(zip(self.accounts[coo.row], self.accounts[coo.col],
+                                          self.weights[coo.data - 1].tolist()))
+        return graph
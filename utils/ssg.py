@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from utils.preprocess import as_datetime64
 
 class SSG:
     """
@@ -41,13 +42,11 @@ class SSG:
 
         # Transaction velocity (transactions per hour)
         if 'timestamp' in df.columns:
-            df_copy = df.copy()
-            df_copy['timestamp'] = pd.to_datetime(df_copy['timestamp'], errors='coerce')
-            df_copy = df_copy.dropna(subset=['timestamp'])
-            if len(df_copy) > 0:
-                time_range_hours = (df_copy['timestamp'].max() - df_copy['timestamp'].min()).total_seconds() / 3600
+            timestamps = as_datetime64(df['timestamp']).dropna()
+            if len(timestamps) > 0:
+                time_range_hours = (timestamps.max() - timestamps.min()).total_seconds() / 3600
                 if time_range_hours > 0:
-                    velocity = len(df_copy) / time_range_hours
+                    velocity = len(timestamps) / time_range_hours
                     stats['transaction_velocity'] = float(velocity) if not pd.isna(velocity) else 0.0
 
         # User activity patterns
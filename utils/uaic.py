@@ -1,7 +1,10 @@
+import numbers
+
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
+from utils.preprocess import as_datetime64
 
 class UAIC:
     """
@@ -9,11 +12,20 @@ class UAIC:
     Uses Isolation Forest for anomaly detection.
     """
 
+    # Columns produced by _create_features, in order
+    feature_names = ['transaction_amount', 'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'user_transaction_frequency']
+    # Batches up to this size are scored with the flattened trees instead of sklearn
+    flat_batch_rows = 1000
+
     def __init__(self, contamination=0.1, random_state=42):
         self.contamination = contamination
         self.random_state = random_state
         self.model = None
         self.scaler = StandardScaler()
+        # Array copy of the fitted model for small inputs, set by fit()
+        self.flat_model = None
+        # Spread of the training decision_function values, set by fit()
+        self.score_scale = 1.0
 
     def fit_predict(self, df):
         """
@@ -22,28 +34,11 @@ class UAIC:
         if len(df) < 20:
             return [0.0] * len(df)
 
-        # Feature engineering
         features = self._create_features(df)
+        self.fit(df, features)
+        return self.predict_batch(df, features)
 
-        # Scale features
-        features_scaled = self.scaler.fit_transform(features)
-
-        # Fit Isolation Forest
-        self.model = IsolationForest(
-            contamination=self.contamination,
-            random_state=self.random_state,
-            n_estimators=100
-        )
-
-        # Get anomaly scores (-1 for outliers, 1 for inliers)
-        scores = self.model.fit_predict(features_scaled)
-
-        # Convert to 0-1 scale (higher = more anomalous)
-        anomaly_scores = (scores == -1).astype(float)
-
-        return anomaly_scores.tolist()
-
-    def fit(self, df):
+    def fit(self, df, features=None):
         """
         Fit the model on the full dataset.
         """
@@ -51,7 +46,8 @@ class UAIC:
             return
 
         # Feature engineering
-        features = self._create_features(df)
+        if features is None:
+            features = self._create_features(df)
 
         # Scale features
         features_scaled = self.scaler.fit_transform(features)
@@ -64,6 +60,26 @@ class UAIC:
         )
 
         self.model.fit(features_scaled)
+        self.flat_model = FlatIsolationForest(self.model, self.scaler)
+        self._calibrate(self.model.decision_function(features_scaled))
+
+    def _calibrate(self, decisions):
+        """
+        Fix the spread used to map decision_function values onto 0-1.
+        A robust spread (IQR) of the training decisions keeps a handful of
+        extreme outliers from flattening the scores of everything else.
+        """
+        q1, q3 = np.percentile(decisions, [25, 75])
+        spread = (q3 - q1) / 1.349
+        self.score_scale = float(spread) if spread > 0 else float(np.std(decisions) or 1.0)
+
+    def _to_anomaly_score(self, decisions):
+        """
+        Calibrated 0-1 anomaly score (higher = more anomalous). The model's own
+        outlier cut-off (decision 0, set by contamination) maps to 0.5, so rows
+        predict() would flag score above 0.5 and the rest below it.
+        """
+        return 1.0 / (1.0 + np.exp(np.asarray(decisions) / self.score_scale))
 
     def predict_single(self, row_dict, df_context=None, precomputed_freqs=None):
         """
@@ -75,20 +91,42 @@ class UAIC:
         # Create features for single row
         features = self._create_features_single(row_dict, df_context, precomputed_freqs)
 
-        # Scale features
-        features_scaled = self.scaler.transform(features.reshape(1, -1))
+        # Continuous 0-1 anomaly score
+        return float(self._to_anomaly_score(self._decision_function(features.reshape(1, -1)))[0])
 
-        # Get anomaly score
-        score = self.model.predict(features_scaled)[0]
+    def predict_batch(self, df, features=None):
+        """
+        Predict anomaly scores for every row of df at once: the feature matrix
+        is built once, scaled once and scored in one model call.
+        Pass `features` to reuse a matrix already built with _create_features.
+        """
+        if self.model is None or len(df) == 0:
+            return [0.0] * len(df)
 
-        # Convert to 0-1 scale (higher = more anomalous)
-        anomaly_score = 1.0 if score == -1 else 0.0
+        if features is None:
+            features = self._create_features(df)
 
-        return anomaly_score
+        # Continuous 0-1 anomaly scores from the trees' path lengths
+        return self._to_anomaly_score(self._decision_function(features)).tolist()
 
-    def _create_features(self, df):
+    def _decision_function(self, features):
+        """
+        IsolationForest decision_function of unscaled feature rows. Small
+        inputs go through the flattened trees, skipping sklearn's per-call
+        validation and per-tree dispatch; large ones through sklearn.
+        """
+        if len(features) <= self.flat_batch_rows:
+            # Models saved before the flat copy existed build it on first use
+            if getattr(self, 'flat_model', None) is None:
+                self.flat_model = FlatIsolationForest(self.model, self.scaler)
+            return self.flat_model.decision_function(features)
+        return self.model.decision_function(self.scaler.transform(features))
+
+    def _create_features(self, df, user_freqs=None):
         """
         Create features for ML model.
+        `user_freqs` optionally gives each row's user frequency (e.g. running
+        counts in Judge Mode) instead of counting users within df.
         """
         features = []
 
@@ -99,8 +137,8 @@ class UAIC:
 
         # Time features
         if 'timestamp' in df.columns:
-            # Parse timestamps and fill errors with current time instead of dropping
-            timestamps = pd.to_datetime(df['timestamp'], errors='coerce')
+            # Canonical column from Preprocessor; fill errors with current time instead of dropping
+            timestamps = as_datetime64(df['timestamp'])
             # If all are NaT, then use current time for all
             if timestamps.isna().all():
                  timestamps = pd.Series([pd.Timestamp.now()] * len(df))
@@ -121,7 +159,9 @@ class UAIC:
             features.append(dow_cos.reshape(-1, 1))
 
         # User activity features
-        if 'user_id' in df.columns:
+        if user_freqs is not None:
+            features.append(np.asarray(user_freqs, dtype=float).reshape(-1, 1))
+        elif 'user_id' in df.columns:
             user_counts = df['user_id'].value_counts()
             user_freq = df['user_id'].map(user_counts).fillna(0)
             features.append(user_freq.values.reshape(-1, 1))
@@ -149,7 +189,10 @@ class UAIC:
         # Time features
         if 'timestamp' in row_dict:
             try:
-                timestamp = pd.to_datetime(row_dict['timestamp'])
+                timestamp = row_dict['timestamp']
+                if not isinstance(timestamp, pd.Timestamp):
+                    # Same parse as pd.to_datetime for one value, without its list machinery
+                    timestamp = pd.Timestamp(timestamp)
                 hour = timestamp.hour
                 # Sin/cos encoding for cyclical time
                 hour_sin = np.sin(2 * np.pi * hour / 24)
@@ -183,3 +226,95 @@ class UAIC:
             return np.array(features).flatten()
         else:
             return np.array([0.0])
+
+
+def average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search among n_samples points (the iTree normaliser c(n))."""
+    n_samples = np.asarray(n_samples, dtype=float)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    many = n_samples > 2
+    lengths[many] = 2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[many] - 1.0) / n_samples[many]
+    return lengths
+
+
+class FlatIsolationForest:
+    """
+    A fitted IsolationForest (with the StandardScaler in front of it)
+    exported to flat NumPy node arrays, for scoring one row or a small batch.
+    All trees are concatenated; each node holds its feature, its threshold
+    with the scaler folded in (x <= t * scale + mean on the raw value), its
+    children and, for leaves, the path length depth + c(samples in leaf).
+    Leaves point to themselves, so every row walks all trees at once in
+    max_depth vectorized steps. Scores match sklearn's up to rows lying
+    within float rounding of a split threshold.
+    """
+
+    def __init__(self, model, scaler):
+        n_features = model.n_features_in_
+        mean = np.zeros(n_features) if getattr(scaler, 'mean_', None) is None else scaler.mean_
+        scale = np.ones(n_features) if getattr(scaler, 'scale_', None) is None else scaler.scale_
+        # sklearn only indexes features per tree when it subsampled them;
+        # max_features resolves to a count as in BaseBagging (int, or a fraction of the features)
+        if isinstance(model.max_features, numbers.Integral):
+            max_features = model.max_features
+        else:
+            max_features = int(model.max_features * n_features)
+        subsampled = max(1, max_features) != n_features
+
+        features, thresholds, lefts, rights, path_lengths, roots = [], [], [], [], [], []
+        offset = 0
+        self.max_depth = 0
+        for estimator, tree_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            leaf = tree.children_left == -1
+
+            feature = np.where(leaf, 0, tree.feature)
+            if subsampled:
+                feature = np.asarray(tree_features)[feature]
+            threshold = np.where(leaf, np.inf, tree.threshold * scale[feature] + mean[feature])
+
+            nodes = np.arange(n_nodes)
+            left = np.where(leaf, nodes, tree.children_left)
+            right = np.where(leaf, nodes, tree.children_right)
+
+            # Children always come after their parent, so one forward pass gives every depth
+            depth = np.zeros(n_nodes)
+            for node in np.flatnonzero(~leaf):
+                depth[tree.children_left[node]] = depth[tree.children_right[node]] = depth[node] + 1
+            self.max_depth = max(self.max_depth, int(depth.max()))
+
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(left + offset)
+            rights.append(right + offset)
+            path_lengths.append(depth + average_path_length(tree.n_node_samples))
+            roots.append(offset)
+            offset += n_nodes
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.path_length = np.concatenate(path_lengths)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.denominator = len(self.roots) * float(average_path_length([model.max_samples_])[0])
+        self.offset = model.offset_
+
+    def score_samples(self, X):
+        """IsolationForest.score_samples for raw (unscaled) rows."""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            nodes = np.where(X[rows, self.feature[nodes]] <= self.threshold[nodes],
+                             self.left[nodes], self.right[nodes])
+        depths = self.path_length[nodes].sum(axis=1)
+        if self.denominator == 0:
+            return -np.ones(len(X))
+        return -2.0 ** (-depths / self.denominator)
+
+    def decision_function(self, X):
+        """IsolationForest.decision_function for raw (unscaled) rows."""
+        return self.score_samples(X) - self.offset